@@ -1,23 +1,18 @@
-from typing import Dict
-from collections import defaultdict
-from app.utils_analytics import safe_dict
+from typing import Any, Dict
+from app.utils_analytics import lab_trends_from_reports
 
 # -------------------------
 # LAB ANALYTICS
 # -------------------------
-def lab_analytics(patient_data: Dict):
-    reports = patient_data.get("reports", [])
-    trends = defaultdict(list)
-
-    for r in reports:
-        if r.report_type == "lab":
-            extracted = safe_dict(r.extracted_data)
-            for k, v in extracted.items():
-                trends[k].append(v)
+def lab_analytics(patient_data: Dict[str, Any]) -> Dict[str, Any]:
+    # Reuse trends already computed by the caller for this request
+    trends = patient_data.get("lab_trends")
+    if trends is None:
+        trends = lab_trends_from_reports(patient_data.get("reports", []))
 
     return {
         "type": "lab",
-        "trends": dict(trends),
+        "trends": trends,
     }
 
 
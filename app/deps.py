@@ -1,3 +1,7 @@
+import json
+
+import httpx
+from fastapi import Request
 from .database import SessionLocal
 from sqlalchemy.orm import Session
 
@@ -8,3 +12,20 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+def get_llm_client(request: Request) -> httpx.AsyncClient:
+    """Ollama client opened once in the app lifespan (see llm.open_client)."""
+    return request.app.state.llm_client
+
+
+# Keyset-paginated list endpoints: the cursor for the next page is sent in
+# the NEXT_CURSOR_HEADER response header when more rows remain
+PAGE_SIZE_DEFAULT = 100
+PAGE_SIZE_MAX = 500
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def sse_event(data: dict) -> str:
+    """One server-sent event for the text/event-stream endpoints."""
+    return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
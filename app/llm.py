@@ -1,36 +1,194 @@
-import requests
+import asyncio
 import json
+from typing import AsyncIterator, List, Optional, Tuple
+
+import httpx
+
+from . import llm_cache
 
 # Ollama server + model name
-OLLAMA_URL = "http://127.0.0.1:11434/api/chat"
+# Ollama only serves requests concurrently when started with
+# OLLAMA_NUM_PARALLEL > 1 (parallel slots per model); keep
+# OLLAMA_MAX_LOADED_MODELS >= 1 so phi3 stays resident between calls.
+OLLAMA_URL = "http://127.0.0.1:11434"
+OLLAMA_CHAT_PATH = "/api/chat"
 MODEL_NAME = "phi3" 
 
-def generate_text(system_prompt: str, user_prompt: str, max_tokens: int = 600) -> str:
-    """
-    Calls local Ollama (Phi 3) with stop sequences to prevent echoing questions.
-    """
+# Shared keep-alive pool; avoids a new TCP connection per generation.
+# The app opens it in its lifespan and injects it into routes (deps.get_llm_client);
+# scripts that call generate_text directly get it created on first use.
+_CLIENT: Optional[httpx.AsyncClient] = None
+
+
+def open_client() -> httpx.AsyncClient:
+    global _CLIENT
+    if _CLIENT is None or _CLIENT.is_closed:
+        _CLIENT = httpx.AsyncClient(
+            base_url=OLLAMA_URL,
+            timeout=300,
+            limits=httpx.Limits(max_connections=32, max_keepalive_connections=16),
+        )
+    return _CLIENT
+
+
+ERROR_MESSAGE = "I encountered an error. Please try again."
+
+
+def _build_payload(
+    system_prompt: str,
+    user_prompt: str,
+    max_tokens: int,
+    temperature: float,
+    stream: bool,
+    json_output: bool = False,
+) -> dict:
     payload = {
         "model": MODEL_NAME,
         "messages": [
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_prompt}
         ],
-        "stream": False,
+        "stream": stream,
         "options": {
             "num_predict": max_tokens,
-            "temperature": 0.1,  # Lower temperature is CRITICAL for script stability
+            "temperature": temperature,  # Lower temperature is CRITICAL for script stability
             "top_p": 0.9,
             # Hard stop sequences to prevent the model from repeating input labels
             "stop": ["User:", "Question:", "Medical Agent:", "Answer:", "[USER]", "[SYSTEM]"]
         },
     }
+    if json_output:
+        # Ollama constrains decoding to valid JSON
+        payload["format"] = "json"
+    return payload
+
+
+async def _cache_lookup(
+    use_cache: bool, system_prompt: str, user_prompt: str, max_tokens: int, scope: Optional[str]
+):
+    if not use_cache:
+        return None, None
+    return await asyncio.to_thread(
+        llm_cache.lookup, system_prompt, user_prompt, max_tokens, scope
+    )
+
+
+async def generate_text(
+    system_prompt: str,
+    user_prompt: str,
+    max_tokens: int = 600,
+    temperature: float = 0.1,
+    client: Optional[httpx.AsyncClient] = None,
+    json_output: bool = False,
+    cache_scope: Optional[str] = None,
+) -> str:
+    """
+    Calls local Ollama (Phi 3) with stop sequences to prevent echoing questions.
+    Repeated prompts are answered from llm_cache; near-duplicates only
+    within the same cache_scope (pass the patient id for prompts that
+    embed patient records).
+    With json_output=True the reply is constrained to a JSON document.
+    """
+    use_cache = llm_cache.is_cacheable(system_prompt, temperature)
+    cached, embedding = await _cache_lookup(
+        use_cache, system_prompt, user_prompt, max_tokens, cache_scope
+    )
+    if cached is not None:
+        return cached
+
+    payload = _build_payload(
+        system_prompt, user_prompt, max_tokens, temperature, stream=False, json_output=json_output
+    )
 
     try:
-        resp = requests.post(OLLAMA_URL, json=payload, timeout=300)
+        resp = await (client or open_client()).post(OLLAMA_CHAT_PATH, json=payload)
         resp.raise_for_status()
         data = resp.json()
-        return data.get("message", {}).get("content", "").strip()
+        text = data.get("message", {}).get("content", "").strip()
 
     except Exception as e:
         print("Ollama generation error:", repr(e))
-        return "I encountered an error. Please try again."
\ No newline at end of file
+        return ERROR_MESSAGE
+
+    if use_cache and text:
+        await asyncio.to_thread(
+            llm_cache.store, system_prompt, user_prompt, max_tokens, text, embedding, cache_scope
+        )
+    return text
+
+
+async def generate_text_stream(
+    system_prompt: str,
+    user_prompt: str,
+    max_tokens: int = 600,
+    temperature: float = 0.1,
+    client: Optional[httpx.AsyncClient] = None,
+    cache_scope: Optional[str] = None,
+) -> AsyncIterator[str]:
+    """
+    Streaming variant of generate_text: yields content deltas as Ollama
+    produces them. A cache hit is yielded as a single chunk.
+    If the consumer stops (client disconnect), the Ollama request is closed,
+    which aborts generation.
+    """
+    use_cache = llm_cache.is_cacheable(system_prompt, temperature)
+    cached, embedding = await _cache_lookup(
+        use_cache, system_prompt, user_prompt, max_tokens, cache_scope
+    )
+    if cached is not None:
+        yield cached
+        return
+
+    payload = _build_payload(system_prompt, user_prompt, max_tokens, temperature, stream=True)
+    parts = []
+
+    try:
+        async with (client or open_client()).stream("POST", OLLAMA_CHAT_PATH, json=payload) as resp:
+            resp.raise_for_status()
+            async for line in resp.aiter_lines():
+                if not line:
+                    continue
+                data = json.loads(line)
+                delta = data.get("message", {}).get("content", "")
+                if delta:
+                    parts.append(delta)
+                    yield delta
+                if data.get("done"):
+                    break
+
+    except Exception as e:
+        print("Ollama generation error:", repr(e))
+        if not parts:
+            yield ERROR_MESSAGE
+        return
+
+    text = "".join(parts).strip()
+    if use_cache and text:
+        await asyncio.to_thread(
+            llm_cache.store, system_prompt, user_prompt, max_tokens, text, embedding, cache_scope
+        )
+
+
+async def generate_texts(
+    pairs: List[Tuple[str, str]],
+    max_tokens: int = 600,
+    client: Optional[httpx.AsyncClient] = None,
+    cache_scope: Optional[str] = None,
+) -> List[str]:
+    """
+    Runs several (system_prompt, user_prompt) generations concurrently.
+    Results are returned in the same order as `pairs`.
+    """
+    return await asyncio.gather(
+        *(
+            generate_text(s, u, max_tokens=max_tokens, client=client, cache_scope=cache_scope)
+            for s, u in pairs
+        )
+    )
+
+
+async def close_client():
+    global _CLIENT
+    if _CLIENT is not None:
+        await _CLIENT.aclose()
+        _CLIENT = None
@@ -0,0 +1,177 @@
+import re
+import time
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+import numpy as np
+import faiss
+
+# Prompt -> response cache in front of the LLM.
+#  - exact tier: hash of (system_prompt, user_prompt, max_tokens)
+#  - semantic tier: MiniLM embedding of the user prompt in a FAISS IndexFlatIP,
+#    partitioned by (system prompt, scope). Prompts carrying patient records
+#    differ only in a few numbers ("BP 120/80" vs "BP 180/110") and embed
+#    almost identically, so the semantic tier is only used when the caller
+#    passes a scope (the patient id) and never matches across scopes.
+CACHE_MAX_ENTRIES = 5000
+CACHE_TTL_SECONDS = 24 * 60 * 60
+SEMANTIC_THRESHOLD = 0.95
+
+# MiniLM only looks at the first ~256 word pieces, so longer prompts that
+# differ only in their tail (e.g. the question after a long record context)
+# would embed identically. Those are served by the exact tier only.
+SEMANTIC_MAX_CHARS = 1000
+
+# generate_text runs at temperature 0.1 by default; anything hotter is
+# expected to vary between calls and is never cached.
+CACHEABLE_MAX_TEMPERATURE = 0.1
+
+# Dates, UUIDs and patient identifiers make a prompt unique to one request.
+_VOLATILE_RE = re.compile(
+    r"\d{4}-\d{2}-\d{2}"
+    r"|\d{1,2}/\d{1,2}/\d{2,4}"
+    r"|[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}"
+    r"|patient\s*id",
+    re.IGNORECASE,
+)
+
+_lock = threading.Lock()
+_exact: "OrderedDict[int, Tuple[str, float]]" = OrderedDict()
+
+_index = None
+# parallel to _index rows: [embedding_row, partition_key, response_text, timestamp, last_used]
+_entries = []
+
+
+def is_cacheable(system_prompt: str, temperature: float) -> bool:
+    if temperature > CACHEABLE_MAX_TEMPERATURE:
+        return False
+    return not _VOLATILE_RE.search(system_prompt or "")
+
+
+def _exact_key(system_prompt: str, user_prompt: str, max_tokens: int) -> int:
+    return hash((system_prompt, user_prompt, max_tokens))
+
+
+def _use_semantic(user_prompt: str, scope: Optional[str]) -> bool:
+    return (
+        scope is not None
+        and len(user_prompt) <= SEMANTIC_MAX_CHARS
+        and not _VOLATILE_RE.search(user_prompt)
+    )
+
+
+def _partition_key(system_prompt: str, scope: str) -> int:
+    return hash((system_prompt, scope))
+
+
+def _embed(user_prompt: str) -> np.ndarray:
+    from .rag import _embed_query
+
+    # shares the query-embedding LRU with RAG search
+    return np.frombuffer(_embed_query(user_prompt), dtype=np.float32).reshape(1, -1).copy()
+
+
+def _expired(ts: float, now: float) -> bool:
+    return now - ts > CACHE_TTL_SECONDS
+
+
+def _rebuild_index(now: float):
+    """Drop expired / least recently used entries and rebuild the FAISS index."""
+    global _index, _entries
+
+    live = [e for e in _entries if not _expired(e[3], now)]
+    if len(live) >= CACHE_MAX_ENTRIES:
+        # evict ~10% at once so we don't rebuild on every insert
+        live.sort(key=lambda e: e[4])
+        live = live[len(live) - int(CACHE_MAX_ENTRIES * 0.9):]
+
+    _entries = live
+    _index = None
+    if live:
+        _index = faiss.IndexFlatIP(live[0][0].shape[0])
+        _index.add(np.vstack([e[0] for e in live]))
+
+
+def lookup(
+    system_prompt: str, user_prompt: str, max_tokens: int, scope: Optional[str] = None
+) -> Tuple[Optional[str], Optional[np.ndarray]]:
+    """
+    Returns (cached_response, query_embedding).
+    The embedding is handed back so store() doesn't have to recompute it.
+    Semantic hits are only served within the same scope.
+    """
+    now = time.time()
+    key = _exact_key(system_prompt, user_prompt, max_tokens)
+
+    with _lock:
+        hit = _exact.get(key)
+        if hit is not None:
+            if not _expired(hit[1], now):
+                _exact.move_to_end(key)
+                return hit[0], None
+            del _exact[key]
+
+    if not _use_semantic(user_prompt, scope):
+        return None, None
+
+    vec = _embed(user_prompt)
+    system_key = _partition_key(system_prompt, scope)
+
+    with _lock:
+        if _index is None or _index.ntotal == 0:
+            return None, vec
+
+        scores, rows = _index.search(vec, min(4, _index.ntotal))
+        for score, row in zip(scores[0], rows[0]):
+            if row < 0 or score < SEMANTIC_THRESHOLD:
+                break
+            entry = _entries[row]
+            if entry[1] != system_key or _expired(entry[3], now):
+                continue
+            entry[4] = now
+            return entry[2], vec
+
+    return None, vec
+
+
+def store(
+    system_prompt: str,
+    user_prompt: str,
+    max_tokens: int,
+    response: str,
+    embedding: Optional[np.ndarray] = None,
+    scope: Optional[str] = None,
+):
+    now = time.time()
+    key = _exact_key(system_prompt, user_prompt, max_tokens)
+
+    with _lock:
+        _exact[key] = (response, now)
+        _exact.move_to_end(key)
+        while len(_exact) > CACHE_MAX_ENTRIES:
+            _exact.popitem(last=False)
+
+    if not _use_semantic(user_prompt, scope):
+        return
+
+    if embedding is None:
+        embedding = _embed(user_prompt)
+
+    global _index
+    with _lock:
+        if len(_entries) >= CACHE_MAX_ENTRIES:
+            _rebuild_index(now)
+        if _index is None:
+            _index = faiss.IndexFlatIP(embedding.shape[1])
+        _index.add(embedding)
+        _entries.append([embedding[0], _partition_key(system_prompt, scope), response, now, now])
+
+
+def clear():
+    global _index, _entries
+    with _lock:
+        _exact.clear()
+        _index = None
+        _entries = []
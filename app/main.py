@@ -1,11 +1,18 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
+import asyncio
 import sqlite3
 import os
 
 from .database import Base, engine, SessionLocal
+from .deps import NEXT_CURSOR_HEADER
 from .models import User
 from .routers.auth import get_password_hash
+from .rag import warm_up, flush as flush_indexes
+from .llm import open_client, close_client
+from .utils_audio import get_asr_model
 from .routers import (
     patients,
     reports,
@@ -17,12 +24,18 @@ from .routers import (
     analytics,
 )
 
+# Uploads (reports, CSVs, audio) above this are refused before being buffered
+MAX_REQUEST_BODY_BYTES = int(os.getenv("MAX_REQUEST_BODY_BYTES", 25 * 1024 * 1024))
+
+
 # -------------------------------
 # Database migration
 # -------------------------------
 def migrate_db():
     """
-    Adds content_hash column to reports table if it doesn't exist.
+    Adds content_hash column, report lookup indexes and the unique
+    (patient_id, content_hash) index to the reports table if they don't
+    exist, and converts hex content hashes to raw 32-byte digests.
     Safe to run multiple times.
     """
     try:
@@ -35,9 +48,50 @@ def migrate_db():
         if "content_hash" not in columns:
             print("Migrating database: Adding content_hash to reports...")
             cursor.execute(
-                "ALTER TABLE reports ADD COLUMN content_hash TEXT"
+                "ALTER TABLE reports ADD COLUMN content_hash BLOB"
             )
             conn.commit()
+
+        if columns:
+            # Hashes used to be stored as 64-char hex TEXT
+            cursor.execute(
+                "SELECT id, content_hash FROM reports WHERE typeof(content_hash) = 'text'"
+            )
+            hex_rows = cursor.fetchall()
+            if hex_rows:
+                print(f"Migrating database: Converting {len(hex_rows)} content hashes to binary...")
+                cursor.executemany(
+                    "UPDATE reports SET content_hash = ? WHERE id = ?",
+                    [(bytes.fromhex(h), report_id) for report_id, h in hex_rows],
+                )
+                conn.commit()
+
+        if columns:
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS ix_reports_patient_type "
+                "ON reports (patient_id, report_type)"
+            )
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS ix_reports_patient_created "
+                "ON reports (patient_id, created_at)"
+            )
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS ix_reports_content_hash "
+                "ON reports (content_hash)"
+            )
+            conn.commit()
+
+            try:
+                cursor.execute(
+                    "CREATE UNIQUE INDEX IF NOT EXISTS ux_reports_patient_hash "
+                    "ON reports (patient_id, content_hash)"
+                )
+                conn.commit()
+            except sqlite3.IntegrityError as e:
+                # Duplicates that slipped in before the index existed must be
+                # removed by hand; the other migrations still apply, and
+                # uploads check for duplicates before inserting until then
+                print(f"Migration warning: cannot create ux_reports_patient_hash: {e}")
     except Exception as e:
         print(f"Migration error: {e}")
     finally:
@@ -75,14 +129,103 @@ def create_initial_admin():
         db.close()
 
 
+def init_db():
+    """Migrates an existing database, then creates any missing tables."""
+    # Both touch the same SQLite file; running them concurrently races
+    migrate_db()
+    Base.metadata.create_all(bind=engine)
+
+
+def warm_up_asr():
+    """
+    Loads Whisper ahead of the first voice request. A failed download or
+    conversion is logged instead of failing startup; the model is then
+    loaded (or the error surfaces) on the first request that needs it.
+    """
+    try:
+        get_asr_model()
+    except Exception as e:
+        print(f"Whisper warm-up failed: {e}")
+
+
+# -------------------------------
+# Startup / shutdown (RENDER SAFE)
+# -------------------------------
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Ensure upload directory exists
+    upload_dir = os.getenv("UPLOAD_DIR", "tmp_audio")
+    os.makedirs(upload_dir, exist_ok=True)
+
+    app.state.llm_client = open_client()
+
+    # DB setup overlaps with embedding and Whisper warm-up, so the first
+    # request doesn't pay for model loading
+    await asyncio.gather(
+        asyncio.to_thread(init_db),
+        asyncio.to_thread(warm_up),
+        asyncio.to_thread(warm_up_asr),
+    )
+    # Needs the users table from init_db
+    await asyncio.to_thread(create_initial_admin)
+
+    yield
+
+    await close_client()
+    await asyncio.to_thread(flush_indexes)
+
+
 # -------------------------------
 # FastAPI app
 # -------------------------------
 app = FastAPI(
     title="Medical RAG Backend",
     version="0.2.0",
+    lifespan=lifespan,
 )
 
+# -------------------------------
+# Request body size limit
+# -------------------------------
+class BodySizeLimitMiddleware:
+    """
+    Answers 413 for bodies over max_bytes: straight from Content-Length
+    before anything is read, or as soon as a chunked body crosses the limit.
+    Runs before FastAPI parses forms, so oversized files are never spooled.
+    """
+
+    def __init__(self, app, max_bytes: int):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length is not None and int(content_length) > self.max_bytes:
+            response = JSONResponse({"detail": "Request body too large"}, status_code=413)
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    raise HTTPException(status_code=413, detail="Request body too large")
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+# Added before CORS so 413 responses still carry CORS headers
+app.add_middleware(BodySizeLimitMiddleware, max_bytes=MAX_REQUEST_BODY_BYTES)
+
 # -------------------------------
 # CORS (safe for dev + prod)
 # -------------------------------
@@ -97,6 +240,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER],
 )
 
 # -------------------------------
@@ -111,21 +255,6 @@ app.include_router(users.router)
 app.include_router(admin.router)
 app.include_router(analytics.router)
 
-# -------------------------------
-# Startup tasks (RENDER SAFE)
-# -------------------------------
-@app.on_event("startup")
-def on_startup():
-    # Ensure upload directory exists
-    upload_dir = os.getenv("UPLOAD_DIR", "tmp_audio")
-    os.makedirs(upload_dir, exist_ok=True)
-
-    # Database setup
-    migrate_db()
-    Base.metadata.create_all(bind=engine)
-    create_initial_admin()
-
-
 # -------------------------------
 # Health check
 # -------------------------------
@@ -7,8 +7,10 @@ from sqlalchemy import (
     Float,
     Boolean,
     Text,
+    LargeBinary,
+    Index,
 )
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, deferred
 from sqlalchemy import JSON
 from datetime import datetime
 
@@ -63,9 +65,10 @@ class Report(Base):
 
     file_path = Column(Text, nullable=True)
 
-    content_hash = Column(String, index=True, nullable=True)
+    content_hash = Column(LargeBinary(32), index=True, nullable=True)  # raw SHA-256
 
-    parsed_text = Column(Text, nullable=True)
+    # Potentially large; only loaded when accessed or explicitly undeferred
+    parsed_text = deferred(Column(Text, nullable=True))
     created_at = Column(DateTime, default=datetime.utcnow)
 
     report_type = Column(String, nullable=True)  # text | image | lab
@@ -76,6 +79,14 @@ class Report(Base):
     patient = relationship("Patient", back_populates="reports")
     uploader = relationship("User")
 
+    # Every analytics / RAG query filters reports by patient (and type or date)
+    __table_args__ = (
+        Index("ix_reports_patient_type", "patient_id", "report_type"),
+        Index("ix_reports_patient_created", "patient_id", "created_at"),
+        # Duplicate upload prevention; NULL hashes (lab JSON / CSV rows) never collide
+        Index("ux_reports_patient_hash", "patient_id", "content_hash", unique=True),
+    )
+
 class LabResult(Base):
     __tablename__ = "lab_results"
 
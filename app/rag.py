@@ -1,16 +1,45 @@
 import os
-import json
-from typing import List, Dict
+import atexit
+import functools
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
 import numpy as np
 import faiss
+import orjson
+import torch
 from sentence_transformers import SentenceTransformer
 
 
 INDEX_DIR = os.path.join("faiss_indexes")
 os.makedirs(INDEX_DIR, exist_ok=True)
 
+TEXT_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+# int8 dynamically-quantized ONNX export shipped in the model repo.
+# Use onnx/model_qint8_avx512_vnni.onnx on CPUs with AVX-512 VNNI.
+TEXT_MODEL_ONNX_FILE = os.getenv("TEXT_MODEL_ONNX_FILE", "onnx/model_quint8_avx2.onnx")
+
+
+def _load_text_model() -> SentenceTransformer:
+    """fp16 on GPU, int8 ONNX Runtime on CPU; plain PyTorch if ONNX isn't available."""
+    if torch.cuda.is_available():
+        return SentenceTransformer(TEXT_MODEL_NAME, device="cuda").half()
+    try:
+        return SentenceTransformer(
+            TEXT_MODEL_NAME,
+            backend="onnx",
+            model_kwargs={
+                "file_name": TEXT_MODEL_ONNX_FILE,
+                "provider": "CPUExecutionProvider",
+            },
+        )
+    except Exception as e:
+        print("ONNX text model unavailable, falling back to PyTorch:", repr(e))
+        return SentenceTransformer(TEXT_MODEL_NAME)
+
+
 # Text model: 384D
-TEXT_MODEL = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
+TEXT_MODEL = _load_text_model()
 TEXT_DIM = TEXT_MODEL.get_sentence_embedding_dimension()  # typically 384
 
 # Image model dim produced by CLIP (utils_image uses clip-ViT-B-32) -> 512
@@ -19,47 +48,217 @@ IMAGE_DIM = 512
 # Final unified dimension for FAISS (we choose the larger = 512)
 EMBED_DIM = max(TEXT_DIM, IMAGE_DIM)  
 
-def _pad_vector(vec: np.ndarray) -> np.ndarray:
-    """Pad vector to EMBED_DIM (float32)."""
-    vec = np.asarray(vec, dtype="float32").reshape(-1)
-    if vec.shape[0] == EMBED_DIM:
-        return vec
-    if vec.shape[0] > EMBED_DIM:
-        return vec[:EMBED_DIM]
-    padded = np.zeros((EMBED_DIM,), dtype="float32")
-    padded[: vec.shape[0]] = vec
+# Vectors are L2-normalized and searched by inner product (cosine).
+# Index tiers by patient size:
+#   < SQ_MIN_TRAIN vectors  -> IndexFlatIP (too few vectors to train a quantizer)
+#   <= HNSW_THRESHOLD       -> IndexScalarQuantizer, 8-bit codes (4x smaller than fp32)
+#   > HNSW_THRESHOLD        -> IndexHNSWSQ, 8-bit codes + HNSW graph
+SQ_MIN_TRAIN = 256
+HNSW_THRESHOLD = 2000
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 80
+HNSW_EF_SEARCH = 64
+
+# In-process LRU of open indexes: patient_id -> (index, metadata, index_mtime).
+# The mtime check picks up writes made by other worker processes.
+INDEX_CACHE_SIZE = 128
+_CACHE: "OrderedDict[str, tuple]" = OrderedDict()
+_LOCK = threading.Lock()
+# Serializes writers only: concurrent uploads (run in worker threads) would
+# otherwise copy the same snapshot and lose each other's adds. Searches take
+# no lock; they rely on writers adding to a copy (_writable_copy) and never
+# mutating an index or metadata list that is already in _CACHE.
+_WRITE_LOCK = threading.Lock()
+# Patients whose cached index has adds (flush=False) not yet written to disk.
+# Dirty entries are never evicted; flush() / interpreter exit persists them.
+_DIRTY = set()
+
+# GPU copies of hot patients' indexes (search only; the CPU index stays the
+# source of truth for adds and persistence). Only available with faiss-gpu.
+GPU_CACHE_SIZE = 16
+_GPU_RES = (
+    faiss.StandardGpuResources()
+    if hasattr(faiss, "StandardGpuResources") and faiss.get_num_gpus() > 0
+    else None
+)
+# patient_id -> (cpu_index, gpu_index, ntotal_at_copy)
+_GPU_CACHE: "OrderedDict[str, tuple]" = OrderedDict()
+# StandardGpuResources and GPU indexes are not thread-safe, even for search,
+# and searches run in worker threads: one GPU copy or search at a time
+_GPU_LOCK = threading.Lock()
+
+
+def _pad_batch(embeddings: np.ndarray) -> np.ndarray:
+    """Pad/truncate a (n, d) batch to (n, EMBED_DIM) float32 in one allocation."""
+    embeddings = np.asarray(embeddings)
+    if embeddings.ndim == 1:
+        embeddings = embeddings[None, :]
+    dim = min(embeddings.shape[1], EMBED_DIM)
+    padded = np.zeros((embeddings.shape[0], EMBED_DIM), dtype=np.float32)
+    padded[:, :dim] = embeddings[:, :dim]
     return padded
 
 
+def _index_tier(n_vectors: int) -> str:
+    if n_vectors > HNSW_THRESHOLD:
+        return "hnsw_sq8"
+    if n_vectors >= SQ_MIN_TRAIN:
+        return "sq8"
+    return "flat"
+
+
+def _current_tier(index) -> str:
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw_sq8"
+    if isinstance(index, faiss.IndexScalarQuantizer):
+        return "sq8"
+    return "flat"
+
+
+def _new_index(n_vectors: int = 0):
+    """Empty (possibly untrained) index of the tier matching `n_vectors`."""
+    tier = _index_tier(n_vectors)
+    if tier == "hnsw_sq8":
+        index = faiss.IndexHNSWSQ(
+            EMBED_DIM, faiss.ScalarQuantizer.QT_8bit, HNSW_M, faiss.METRIC_INNER_PRODUCT
+        )
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+        return index
+    if tier == "sq8":
+        return faiss.IndexScalarQuantizer(
+            EMBED_DIM, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT
+        )
+    # Flat scan is cheaper than training/building for small patients
+    return faiss.IndexFlatIP(EMBED_DIM)
+
+
+def _rebuild_index(index):
+    """
+    Re-create an index as normalized inner-product of the right tier for its size,
+    training the quantizer on all current vectors.
+    Used to migrate legacy IndexFlatL2 files and to promote flat -> sq8 -> hnsw.
+    """
+    new_index = _new_index(index.ntotal)
+    if index.ntotal:
+        vectors = np.ascontiguousarray(index.reconstruct_n(0, index.ntotal), dtype=np.float32)
+        faiss.normalize_L2(vectors)
+        if not new_index.is_trained:
+            new_index.train(vectors)
+        new_index.add(vectors)
+    return new_index
+
+
+def _add_vectors(index, vectors: np.ndarray):
+    """Normalize and add (n, EMBED_DIM) vectors; returns the (possibly new) index."""
+    if index.d != EMBED_DIM:
+        # recreate index to correct dim
+        index = _new_index()
+
+    faiss.normalize_L2(vectors)
+    index.add(vectors)
+
+    if _current_tier(index) != _index_tier(index.ntotal):
+        index = _rebuild_index(index)
+    return index
+
+
 def _get_index_paths(patient_id: str):
     index_path = os.path.join(INDEX_DIR, f"{patient_id}.index")
     meta_path = os.path.join(INDEX_DIR, f"{patient_id}_meta.json")
     return index_path, meta_path
 
 
+def _index_mtime(index_path: str):
+    try:
+        return os.path.getmtime(index_path)
+    except OSError:
+        return None
+
+
+def _cache_put(patient_id: str, index, metadata: List[Dict], mtime, dirty: bool = False):
+    with _LOCK:
+        _CACHE[patient_id] = (index, metadata, mtime)
+        _CACHE.move_to_end(patient_id)
+        if dirty:
+            _DIRTY.add(patient_id)
+        else:
+            _DIRTY.discard(patient_id)
+        while len(_CACHE) > INDEX_CACHE_SIZE:
+            victim = next((pid for pid in _CACHE if pid not in _DIRTY), None)
+            if victim is None:
+                break
+            del _CACHE[victim]
+
+
+def _writable_copy(patient_id: str):
+    """
+    Private copy of a patient's cached index and metadata for a writer to add to.
+    Searches keep using the old pair until _save_index_and_meta swaps the copy
+    into _CACHE, so they never see an index or list that is being mutated.
+    """
+    index, metadata = _load_or_create_index(patient_id)
+    return faiss.clone_index(index), list(metadata)
+
+
 def _load_or_create_index(patient_id: str):
     index_path, meta_path = _get_index_paths(patient_id)
+    mtime = _index_mtime(index_path)
+
+    with _LOCK:
+        cached = _CACHE.get(patient_id)
+        # a dirty entry is newer than whatever is on disk
+        if cached is not None and (cached[2] == mtime or patient_id in _DIRTY):
+            _CACHE.move_to_end(patient_id)
+            return cached[0], cached[1]
 
     if os.path.exists(index_path) and os.path.exists(meta_path):
         try:
             index = faiss.read_index(index_path)
+            if index.metric_type != faiss.METRIC_INNER_PRODUCT:
+                index = _rebuild_index(index)
+            elif isinstance(index, faiss.IndexHNSW):
+                index.hnsw.efSearch = HNSW_EF_SEARCH
         except Exception:
             # If read fails, recreate clean index
-            index = faiss.IndexFlatL2(EMBED_DIM)
-        with open(meta_path, "r", encoding="utf-8") as f:
-            metadata = json.load(f)
+            index = _new_index()
+        with open(meta_path, "rb") as f:
+            metadata = orjson.loads(f.read())
     else:
-        index = faiss.IndexFlatL2(EMBED_DIM)
+        index = _new_index()
         metadata = []
 
+    _cache_put(patient_id, index, metadata, mtime)
     return index, metadata
 
 
-def _save_index_and_meta(patient_id: str, index, metadata: List[Dict]):
+def _save_index_and_meta(patient_id: str, index, metadata: List[Dict], flush: bool = True):
     index_path, meta_path = _get_index_paths(patient_id)
+    if not flush:
+        # keep the change in memory only; a later flush writes it
+        _cache_put(patient_id, index, metadata, _index_mtime(index_path), dirty=True)
+        return
+
     faiss.write_index(index, index_path)
-    with open(meta_path, "w", encoding="utf-8") as f:
-        json.dump(metadata, f, ensure_ascii=False, indent=2)
+    with open(meta_path, "wb") as f:
+        f.write(orjson.dumps(metadata))
+    _cache_put(patient_id, index, metadata, _index_mtime(index_path))
+
+
+def flush(patient_id: Optional[str] = None):
+    """Writes deferred index changes to disk, for one patient or all of them."""
+    with _WRITE_LOCK:
+        with _LOCK:
+            pending = [
+                (pid, _CACHE[pid][0], _CACHE[pid][1])
+                for pid in _DIRTY
+                if patient_id is None or pid == patient_id
+            ]
+        for pid, index, metadata in pending:
+            _save_index_and_meta(pid, index, metadata)
+
+
+atexit.register(flush)
 
 
 def _chunk_text(text: str, max_chars=800, overlap=100) -> List[str]:
@@ -74,80 +273,141 @@ def _chunk_text(text: str, max_chars=800, overlap=100) -> List[str]:
     if step <= 0:
         step = max_chars
 
-    chunks = []
-    start = 0
-    while start < len(text):
-        end = min(start + max_chars, len(text))
-        chunk = text[start:end]
-        if chunk.strip():
-            chunks.append(chunk.strip())
-
-        if end >= len(text):
-            break
-
-        start += step
-
-    return chunks
+    # Window starts: every `step` chars, stopping once a window reaches the end
+    stop = max(len(text) - max_chars + step, 1)
+    return [
+        chunk
+        for start in range(0, stop, step)
+        for chunk in (text[start:start + max_chars].strip(),)
+        if chunk
+    ]
 
 
 # ADD TEXT
-def add_text_to_index(patient_id: str, report_id: int, text: str):
+def add_text_to_index(patient_id: str, report_id: int, text: str, flush: bool = True):
     """
     Chunk text, compute text embeddings (384D) -> pad to 512D -> add to FAISS.
+    With flush=False the index is only updated in memory until flush().
     """
-    chunks = _chunk_text(text)
-    if not chunks:
-        return
-
-    index, metadata = _load_or_create_index(patient_id)
-
-    embeddings = TEXT_MODEL.encode(chunks, convert_to_numpy=True).astype("float32")
-    padded_embeddings = np.vstack([_pad_vector(e) for e in embeddings])  # shape (n, EMBED_DIM)
+    add_texts_to_index([(patient_id, report_id, text)], flush=flush)
 
-    # ensure dim matches index
-    if index.d != EMBED_DIM:
-        # recreate index to correct dim
-        index = faiss.IndexFlatL2(EMBED_DIM)
 
-    index.add(padded_embeddings)
+def add_texts_to_index(items: Iterable[Tuple[str, int, str]], flush: bool = True):
+    """
+    Batched add_text_to_index for (patient_id, report_id, text) items.
+    All chunks are encoded in one call and each patient's index is
+    loaded and written once, however many of its reports are in the batch.
+    """
+    by_patient: Dict[str, List[Tuple[int, str]]] = {}
+    for patient_id, report_id, text in items:
+        for chunk in _chunk_text(text):
+            by_patient.setdefault(patient_id, []).append((report_id, chunk))
 
-    base = len(metadata)
-    for i, chunk in enumerate(chunks):
-        metadata.append({
-            "chunk_id": base + i,
-            "report_id": report_id,
-            "type": "text",
-            "text": chunk
-        })
+    if not by_patient:
+        return
 
-    _save_index_and_meta(patient_id, index, metadata)
+    all_chunks = [chunk for pairs in by_patient.values() for _, chunk in pairs]
+    embeddings = TEXT_MODEL.encode(
+        all_chunks,
+        batch_size=64,
+        convert_to_numpy=True,
+        normalize_embeddings=False,
+        show_progress_bar=False,
+    )
+    padded_embeddings = _pad_batch(embeddings)  # shape (n, EMBED_DIM)
+
+    offset = 0
+    for patient_id, pairs in by_patient.items():
+        vectors = padded_embeddings[offset:offset + len(pairs)]
+        offset += len(pairs)
+
+        with _WRITE_LOCK:
+            index, metadata = _writable_copy(patient_id)
+            index = _add_vectors(index, vectors)
+
+            base = len(metadata)
+            for i, (report_id, chunk) in enumerate(pairs):
+                metadata.append({
+                    "chunk_id": base + i,
+                    "report_id": report_id,
+                    "type": "text",
+                    "text": chunk
+                })
+
+            _save_index_and_meta(patient_id, index, metadata, flush=flush)
 
 
 # ADD IMAGE
-def add_image_to_index(patient_id: str, report_id: int, embedding: np.ndarray):
+def add_image_to_index(patient_id: str, report_id: int, embedding: np.ndarray, flush: bool = True):
     """
     embedding: raw image vector (likely 512D). Pad/truncate then add.
+    With flush=False the index is only updated in memory until flush().
     """
     if embedding is None:
         return
 
-    index, metadata = _load_or_create_index(patient_id)
+    vec = _pad_batch(embedding)  # shape (1, EMBED_DIM)
 
-    vec = _pad_vector(embedding).astype("float32").reshape(1, -1)
+    with _WRITE_LOCK:
+        index, metadata = _writable_copy(patient_id)
+        index = _add_vectors(index, vec)
+
+        metadata.append({
+            "chunk_id": len(metadata),
+            "report_id": report_id,
+            "type": "image",
+            "text": "(IMAGE EMBEDDING)"
+        })
+
+        _save_index_and_meta(patient_id, index, metadata, flush=flush)
 
-    if index.d != EMBED_DIM:
-        index = faiss.IndexFlatL2(EMBED_DIM)
 
-    index.add(vec)
+@functools.lru_cache(maxsize=4096)
+def _embed_query(query: str) -> bytes:
+    """
+    Normalized MiniLM embedding of a query, cached so repeated queries
+    (dashboard reloads, retries) skip the encoder. Stored as immutable bytes.
+    """
+    vec = TEXT_MODEL.encode([query], convert_to_numpy=True, normalize_embeddings=True)[0]
+    return vec.astype(np.float32).tobytes()
 
-    metadata.append({
-        "chunk_id": len(metadata),
-        "report_id": report_id,
-        "type": "image",
-        "text": "(IMAGE EMBEDDING)"
-    })
 
-    _save_index_and_meta(patient_id, index, metadata)
+def _search_index(patient_id: str, index):
+    """
+    Index to run searches on: a GPU copy of `index` for hot patients when a
+    GPU is available, otherwise `index` itself.
+    """
+    if _GPU_RES is None:
+        return index
+
+    with _LOCK:
+        entry = _GPU_CACHE.get(patient_id)
+        if entry is not None and entry[0] is index and entry[2] == index.ntotal:
+            _GPU_CACHE.move_to_end(patient_id)
+            return entry[1]
+
+    try:
+        with _GPU_LOCK:
+            gpu_index = faiss.index_cpu_to_gpu(_GPU_RES, 0, index)
+    except Exception:
+        # e.g. HNSW / scalar-quantized flat indexes have no GPU implementation
+        return index
+
+    with _LOCK:
+        _GPU_CACHE[patient_id] = (index, gpu_index, index.ntotal)
+        _GPU_CACHE.move_to_end(patient_id)
+        while len(_GPU_CACHE) > GPU_CACHE_SIZE:
+            _GPU_CACHE.popitem(last=False)
+    return gpu_index
+
+
+def _search(patient_id: str, index, queries: np.ndarray, top_k: int):
+    """index.search, on its GPU copy (serialized by _GPU_LOCK) when there is one."""
+    search_index = _search_index(patient_id, index)
+    if search_index is index:
+        return index.search(queries, top_k)
+    with _GPU_LOCK:
+        return search_index.search(queries, top_k)
 
 
 # SEARCH BY QUERY (text)
@@ -156,10 +416,9 @@ def search_patient_index(patient_id: str, query: str, top_k: int = 5) -> List[Di
     if index.ntotal == 0 or not metadata:
         return []
 
-    qvec = TEXT_MODEL.encode([query], convert_to_numpy=True)[0]
-    qvec = _pad_vector(qvec).reshape(1, -1).astype("float32")
+    qvec = _pad_batch(np.frombuffer(_embed_query(query), dtype=np.float32))
 
-    distances, indices = index.search(qvec, top_k)
+    distances, indices = _search(patient_id, index, qvec, top_k)
 
     results = []
     for idx in indices[0]:
@@ -169,29 +428,48 @@ def search_patient_index(patient_id: str, query: str, top_k: int = 5) -> List[Di
     return results
 
 
-# SEARCH BY VECTOR (image -> nearest text chunks)
-def search_by_vector(patient_id: str, vector: np.ndarray, top_k: int = 5) -> List[Dict]:
+# SEARCH BY VECTORS (batched)
+def search_batch(patient_id: str, vectors: np.ndarray, top_k: int = 5) -> List[List[Dict]]:
     """
-    Use a vector (image or text) to search the patient's index and return the top-k metadata entries.
+    Search several query vectors (image or text, shape (n, d)) in one FAISS call.
+    Returns one top-k result list per query vector, in order.
     """
+    q = _pad_batch(vectors)
     index, metadata = _load_or_create_index(patient_id)
     if index.ntotal == 0 or not metadata:
-        return []
+        return [[] for _ in range(q.shape[0])]
 
-    q = _pad_vector(vector).reshape(1, -1).astype("float32")
-    distances, indices = index.search(q, top_k)
+    faiss.normalize_L2(q)
+    distances, indices = _search(patient_id, index, q, top_k)
 
-    results = []
-    for idx in indices[0]:
-        if 0 <= idx < len(metadata):
-            # include distance for debugging usefulness
-            entry = dict(metadata[idx])
-            # add approximate similarity score
-            results.append({"distance": float(distances[0][list(indices[0]).index(idx)]), **entry})
+    batch = []
+    for row_dist, row_idx in zip(distances, indices):
+        results = []
+        for rank, idx in enumerate(row_idx):
+            # FAISS pads missing results with -1
+            if idx == -1:
+                continue
+            if 0 <= idx < len(metadata):
+                # include similarity score for debugging usefulness
+                results.append({"distance": float(row_dist[rank]), **metadata[idx]})
+        batch.append(results)
+
+    return batch
 
-    return results
+
+# SEARCH BY VECTOR (image -> nearest text chunks)
+def search_by_vector(patient_id: str, vector: np.ndarray, top_k: int = 5) -> List[Dict]:
+    """
+    Use a vector (image or text) to search the patient's index and return the top-k metadata entries.
+    """
+    return search_batch(patient_id, vector, top_k)[0]
 
 # UTILS
+def warm_up():
+    """Run one encode so the first user request doesn't pay graph/session init."""
+    TEXT_MODEL.encode(["warm up"], convert_to_numpy=True, show_progress_bar=False)
+
+
 def get_patient_index_stats(patient_id: str):
     index, metadata = _load_or_create_index(patient_id)
     return {
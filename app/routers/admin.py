@@ -5,14 +5,14 @@ from sqlalchemy.orm import Session
 
 from .. import models, schemas
 from ..deps import get_db
-from .auth import get_current_user, get_password_hash  
+from .auth import CurrentUser, get_current_user, get_password_hash  
 
 router = APIRouter(prefix="/admin", tags=["admin"])
 
 
 def get_current_admin(
-    current_user: models.User = Depends(get_current_user),
-) -> models.User:
+    current_user: CurrentUser = Depends(get_current_user),
+) -> CurrentUser:
     """
     Dependency: only allow users with role='admin'.
     """
@@ -27,7 +27,7 @@ def get_current_admin(
 @router.get("/users", response_model=List[schemas.UserOut])
 def admin_list_users(
     db: Session = Depends(get_db),
-    admin: models.User = Depends(get_current_admin),
+    admin: CurrentUser = Depends(get_current_admin),
 ):
     users = db.query(models.User).all()
     return users
@@ -37,7 +37,7 @@ def admin_list_users(
 def admin_create_user(
     user_in: schemas.UserCreate,
     db: Session = Depends(get_db),
-    admin: models.User = Depends(get_current_admin),
+    admin: CurrentUser = Depends(get_current_admin),
 ):
 
     # Check username uniqueness
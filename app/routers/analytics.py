@@ -1,8 +1,16 @@
 from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import text
 from sqlalchemy.orm import Session
-from collections import defaultdict
-
-from app.utils_analytics import safe_dict, safe_list
+from collections import defaultdict, Counter
+from typing import Any, Dict, Iterable, List
+import numpy as np
+
+from app.utils_analytics import (
+    safe_dict,
+    safe_list,
+    lab_trends_from_reports,
+    lab_trends_from_rows,
+)
 from app.deps import get_db
 from app import models
 from app.routers.auth import get_current_user
@@ -24,27 +32,27 @@ def detect_modalities(reports):
     return modalities
 
 
-def compute_lab_trends(reports):
-    trends = defaultdict(list)
-    for r in reports:
-        if r.report_type == "lab":
-            extracted = safe_dict(r.extracted_data)
-            for k, v in extracted.items():
-                trends[k].append(v)
-    return dict(trends)
+def compute_lab_trends(reports: Iterable[Any]) -> Dict[str, List[Any]]:
+    return lab_trends_from_reports(reports)
+
+
+def _risk_from_hba1c(values) -> str:
+    # single vectorized reduction; NaNs (missing readings) are ignored
+    max_val = np.nanmax(np.asarray(values, dtype=np.float64))
+    if max_val >= 8:
+        return "high"
+    if max_val >= 6.5:
+        return "medium"
+    return "low"
 
 
-def compute_simple_risk(trends):
+def compute_simple_risk(trends: Dict[str, List[Any]]) -> str:
     risk = "low"
 
     hba1c_vals = safe_list(trends.get("hba1c"))
     if hba1c_vals:
         try:
-            max_val = max(hba1c_vals)
-            if max_val >= 8:
-                risk = "high"
-            elif max_val >= 6.5:
-                risk = "medium"
+            risk = _risk_from_hba1c(hba1c_vals)
         except Exception:
             pass
 
@@ -55,27 +63,34 @@ def compute_risk_distribution(db: Session):
     """
     Population-level risk distribution across all patients
     """
-    patients = db.query(models.Patient).all()
+    patients = db.query(models.Patient.patient_id).all()
     dist = {"low": 0, "medium": 0, "high": 0}
 
-    for p in patients:
-        reports = (
-            db.query(models.Report)
-            .filter(models.Report.patient_id == p.patient_id)
-            .all()
-        )
+    # One query for every lab report instead of one per patient
+    rows = (
+        db.query(models.Report.patient_id, models.Report.extracted_data)
+        .filter(models.Report.report_type == "lab")
+        .all()
+    )
+
+    trends_by_patient = defaultdict(lambda: defaultdict(list))
+    for patient_id, extracted_data in rows:
+        trends = trends_by_patient[patient_id]
+        for k, v in safe_dict(extracted_data).items():
+            trends[k].append(v)
 
-        lab_trends = compute_lab_trends(reports)
-        risk = compute_simple_risk(lab_trends)
+    for (patient_id,) in patients:
+        risk = compute_simple_risk(trends_by_patient.get(patient_id, {}))
         dist[risk] += 1
 
     return dist
 
-def run_registry_analytics(modalities, reports):
+def run_registry_analytics(modalities, reports, lab_trends=None):
     results = {}
     patient_data = {
         "reports": reports,
         "modalities": modalities,
+        "lab_trends": lab_trends,
     }
 
     for name, entry in ANALYTICS_REGISTRY.items():
@@ -97,7 +112,7 @@ def patient_analytics(
         raise HTTPException(status_code=403, detail="Access denied")
 
     reports = (
-        db.query(models.Report)
+        db.query(models.Report.report_type, models.Report.extracted_data)
         .filter(models.Report.patient_id == patient_id)
         .all()
     )
@@ -113,14 +128,18 @@ def patient_analytics(
             "message": "No reports uploaded yet",
         }
 
-    modalities = detect_modalities(reports)
-    lab_trends = compute_lab_trends(reports) if "lab" in modalities else {}
-    adaptive_analytics = run_registry_analytics(modalities, reports)
-
-    report_distribution = defaultdict(int)
+    # Single pass: modalities, per-type counts and lab rows together
+    modalities, report_distribution, lab_rows = set(), Counter(), []
     for r in reports:
-        if r.report_type:
-            report_distribution[r.report_type] += 1
+        rt = r.report_type
+        if rt:
+            modalities.add(rt)
+            report_distribution[rt] += 1
+        if rt == "lab":
+            lab_rows.append(r.extracted_data)
+
+    lab_trends = lab_trends_from_rows(lab_rows) if lab_rows else {}
+    adaptive_analytics = run_registry_analytics(modalities, reports, lab_trends)
 
     return {
         "patient_id": patient_id,
@@ -147,7 +166,7 @@ def doctor_analytics_patient(
         raise HTTPException(status_code=403, detail="Doctor access required")
 
     reports = (
-        db.query(models.Report)
+        db.query(models.Report.report_type, models.Report.extracted_data)
         .filter(models.Report.patient_id == patient_id)
         .all()
     )
@@ -186,9 +205,13 @@ def doctor_analytics_population(
 
     risk_dist = compute_risk_distribution(db)
 
+    total_patients, total_reports = db.execute(
+        text("SELECT (SELECT COUNT(*) FROM patients), (SELECT COUNT(*) FROM reports)")
+    ).one()
+
     return {
-        "total_patients": db.query(models.Patient).count(),
-        "reports_today": db.query(models.Report).count(),
+        "total_patients": total_patients,
+        "reports_today": total_reports,
         "risk_distribution": [
             {"name": "Low Risk", "value": risk_dist["low"]},
             {"name": "Medium Risk", "value": risk_dist["medium"]},
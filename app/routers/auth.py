@@ -1,3 +1,10 @@
+import os
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from datetime import datetime, timedelta
 from typing import Optional
 
@@ -19,7 +26,20 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24  # 1 day
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# token -> (CurrentUser, cache_expiry). Entries live at most TOKEN_CACHE_TTL
+# seconds and never past the token's own exp, so role changes apply within a minute.
+TOKEN_CACHE_TTL = 60
+TOKEN_CACHE_SIZE = 10_000
+_token_cache: "OrderedDict[str, tuple]" = OrderedDict()
+_token_cache_lock = threading.Lock()
+
+# Cost factor is configurable per deployment; keep it >= 10
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+# Dedicated pool so a burst of logins can't starve the default executor
+_HASH_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="bcrypt")
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
@@ -30,6 +50,11 @@ def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
 
+async def averify_password(plain_password: str, hashed_password: str) -> bool:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_HASH_EXECUTOR, verify_password, plain_password, hashed_password)
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     to_encode = data.copy()
     expire = datetime.utcnow() + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
@@ -42,27 +67,64 @@ def get_user_by_username(db: Session, username: str) -> Optional[models.User]:
     return db.query(models.User).filter(models.User.username == username).first()
 
 
-def authenticate_user(db: Session, username: str, password: str) -> Optional[models.User]:
+async def authenticate_user(db: Session, username: str, password: str) -> Optional[models.User]:
     user = get_user_by_username(db, username)
     if not user:
         return None
-    if not verify_password(password, user.password_hash):
+    if not await averify_password(password, user.password_hash):
         return None
     return user
 
 
 # ---------- Dependencies ----------
 
+@dataclass(frozen=True)
+class CurrentUser:
+    """The user fields request handlers actually read."""
+    id: int
+    username: str
+    role: str
+    patient_id: Optional[str] = None
+
+
+def _cached_user(token: str) -> Optional[CurrentUser]:
+    now = time.time()
+    with _token_cache_lock:
+        entry = _token_cache.get(token)
+        if entry is None:
+            return None
+        if entry[1] <= now:
+            del _token_cache[token]
+            return None
+        _token_cache.move_to_end(token)
+        return entry[0]
+
+
+def _cache_user(token: str, user: CurrentUser, token_exp: Optional[float]):
+    expiry = time.time() + TOKEN_CACHE_TTL
+    if token_exp is not None:
+        expiry = min(expiry, token_exp)
+    with _token_cache_lock:
+        _token_cache[token] = (user, expiry)
+        _token_cache.move_to_end(token)
+        while len(_token_cache) > TOKEN_CACHE_SIZE:
+            _token_cache.popitem(last=False)
+
+
 async def get_current_user(
     token: str = Depends(oauth2_scheme),
     db: Session = Depends(get_db),
-) -> models.User:
+) -> CurrentUser:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
 
+    cached = _cached_user(token)
+    if cached is not None:
+        return cached
+
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
@@ -75,7 +137,15 @@ async def get_current_user(
     user = get_user_by_username(db, username=token_data.username)
     if user is None:
         raise credentials_exception
-    return user
+
+    current = CurrentUser(
+        id=user.id,
+        username=user.username,
+        role=user.role,
+        patient_id=user.patient_id,
+    )
+    _cache_user(token, current, payload.get("exp"))
+    return current
 
 
 # ---------- Routes ----------
@@ -104,11 +174,11 @@ def register_user(user_in: schemas.UserCreate, db: Session = Depends(get_db)):
 
 
 @router.post("/login", response_model=schemas.Token)
-def login_for_access_token(
+async def login_for_access_token(
     form_data: OAuth2PasswordRequestForm = Depends(),
     db: Session = Depends(get_db),
 ):
-    user = authenticate_user(db, form_data.username, form_data.password)
+    user = await authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -121,7 +191,7 @@ def login_for_access_token(
 
 @router.get("/me", response_model=schemas.UserOut)
 def read_current_user(
-    current_user: models.User = Depends(get_current_user),
+    current_user: CurrentUser = Depends(get_current_user),
 ):
     """
     Return the currently authenticated user's basic info
@@ -1,13 +1,18 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Request
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, UploadFile, File, Request
+from fastapi.responses import JSONResponse, StreamingResponse
 from sqlalchemy.orm import Session
-import os, uuid
+import httpx
+import os, re, uuid, asyncio, hashlib, functools
+from collections import OrderedDict
 from typing import Optional
 from .. import models, schemas
-from ..deps import get_db
-from .auth import get_current_user
+from ..database import SessionLocal
+from ..deps import get_db, get_llm_client, sse_event
+from .auth import CurrentUser, get_current_user
 from ..rag import search_patient_index
-from ..llm import generate_text
-from ..utils_audio import transcribe_audio_file, text_to_speech
+from ..llm import generate_text, generate_text_stream
+from ..utils_text import save_upload_file, tail_join
+from ..utils_audio import transcribe_audio_file, text_to_speech_bytes
 
 router = APIRouter(prefix="/chat", tags=["chat"])
 
@@ -16,18 +21,60 @@ TMP_AUDIO_DIR = "tmp_audio"
 os.makedirs(AUDIO_RESPONSE_DIR, exist_ok=True)
 os.makedirs(TMP_AUDIO_DIR, exist_ok=True)
 
+# Sentences sent to gTTS at once while the answer is still streaming
+TTS_CONCURRENCY = 3
+_SENTENCE_END = re.compile(r"(?<=[.?!\u0964])\s+")
+
+# Synthesized audio is content-addressed by sha256(language \0 text):
+#  - whole answers are stored as AUDIO_RESPONSE_DIR/<key>.mp3 and reused
+#  - per-sentence MP3 parts are kept in an in-process LRU so recurring
+#    sentences (greetings, "no data" fallbacks) are never re-synthesized
+TTS_PART_CACHE_SIZE = 512
+# Only touched from the event loop, so no lock is needed
+_TTS_PART_CACHE: "OrderedDict[str, bytes]" = OrderedDict()
+
+# Answer audio still being written ("pending") or that could not be
+# synthesized ("failed"), reported by GET /chat/audio/{key}. Per process:
+# another worker only knows whether the file exists.
+TTS_STATUS_SIZE = 1024
+_TTS_STATUS: "OrderedDict[str, str]" = OrderedDict()
+_TTS_KEY_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+def _tts_key(language: str, text: str) -> str:
+    return hashlib.sha256(f"{language}\0{text}".encode("utf-8")).hexdigest()
+
+
+def _set_tts_status(key: str, status: str):
+    _TTS_STATUS[key] = status
+    _TTS_STATUS.move_to_end(key)
+    while len(_TTS_STATUS) > TTS_STATUS_SIZE:
+        _TTS_STATUS.popitem(last=False)
+
+
+def _tts_part_cache_put(key: str, audio: bytes):
+    _TTS_PART_CACHE[key] = audio
+    _TTS_PART_CACHE.move_to_end(key)
+    while len(_TTS_PART_CACHE) > TTS_PART_CACHE_SIZE:
+        _TTS_PART_CACHE.popitem(last=False)
+
+# Most recent lab reports used as fallback chat context
+LAB_CONTEXT_LIMIT = 50
+
+
 def build_lab_context(db: Session, patient_id: str) -> str:
     """
     Builds readable lab context from structured lab reports.
     Used when FAISS text context is empty or insufficient.
     """
     reports = (
-        db.query(models.Report)
+        db.query(models.Report.created_at, models.Report.extracted_data)
         .filter(
             models.Report.patient_id == patient_id,
             models.Report.report_type == "lab",
         )
         .order_by(models.Report.created_at.desc())
+        .limit(LAB_CONTEXT_LIMIT)
         .all()
     )
 
@@ -68,13 +115,7 @@ def safe_search_patient_index(patient_id: str, query: str, top_k: int = 8):
         print("RAG search skipped:", e)
         return []
 
-@router.post("/{patient_id}", response_model=schemas.ChatOut)
-async def chat_with_patient_history(
-    patient_id: str,
-    request: Request,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user),
-):
+def _ensure_chat_access(db: Session, patient_id: str, current_user):
     if current_user.role == "patient" and current_user.patient_id != patient_id:
         raise HTTPException(status_code=403, detail="Not allowed")
 
@@ -85,6 +126,238 @@ async def chat_with_patient_history(
     if not patient:
         raise HTTPException(status_code=404, detail="Patient not found")
 
+
+# --- UPDATED PROMPT TO STOP MIRRORING ---
+# Only {language} varies; filled in by _chat_system_prompt
+CHAT_SYSTEM_PROMPT_TMPL = """
+        You are a medical assistant.
+
+        CRITICAL LANGUAGE RULE (MANDATORY):
+        - You MUST reply ONLY in the following language: {language}
+        - If the user asks in Tamil, reply ONLY in Tamil.
+        - DO NOT repeat the user's question. Start your response directly.
+        - NEVER ask "What is your problem?" back to the user.
+
+        MEDICAL RULES:
+        - Use simple language if the user is a patient.
+        - Use medical terminology if the user is a doctor.
+        - Use ONLY the provided patient records.
+        - If information is missing, clearly say you do not have enough data.
+        - Do NOT prescribe medicines or dosages.
+    """
+
+
+@functools.lru_cache(maxsize=32)
+def _chat_system_prompt(language: str) -> str:
+    return CHAT_SYSTEM_PROMPT_TMPL.format(language=language)
+
+
+def _build_chat_prompts(
+    db: Session,
+    patient_id: str,
+    question: Optional[str],
+    language: str,
+    file_context: str = "",
+    search_hint: Optional[str] = None,
+):
+    """
+    Retrieves patient context (FAISS, falling back to lab data) and builds the
+    (system_prompt, user_prompt, final_query) triple for a chat turn.
+    """
+    base_question = question or "Analyze the uploaded content"
+    final_query = f"{base_question}\n{file_context}" if file_context else base_question
+
+    rag_query = question or search_hint or base_question
+    chunks = safe_search_patient_index(patient_id, query=rag_query, top_k=8)
+
+    MAX_PROMPT_CHARS = 3500
+
+    # Only the tail that survives the MAX_PROMPT_CHARS cut below is joined
+    context = tail_join(
+        [c["text"] for c in chunks if isinstance(c, dict) and c.get("text")] if chunks else [],
+        "\n\n---\n\n",
+        MAX_PROMPT_CHARS,
+    )
+
+    if context:
+        context = (
+            "Patient records are ordered chronologically. "
+            "Recent findings appear later in the text.\n\n"
+            + context
+        )
+
+    if not context:
+        lab_context = build_lab_context(db, patient_id)
+
+        if lab_context:
+            context = (
+                "The following are structured lab results for this patient:\n\n"
+                + lab_context
+            )
+        else:
+            context = (
+                "No medical reports are available yet for this patient."
+            )
+
+    system_prompt = _chat_system_prompt(language)
+
+    if len(context) > MAX_PROMPT_CHARS:
+        context = context[-MAX_PROMPT_CHARS:]
+
+    if len(final_query) > 1000:
+        final_query = final_query[:1000]
+    
+    # FIXED: user_prompt defined BEFORE generate_text
+    user_prompt = f"""
+    Patient ID: {patient_id}
+
+    Patient record snippets:
+    {context if context else "[NO DATA AVAILABLE]"}
+
+    User query:
+    {final_query}
+
+    FINAL CHECK:
+    - Answer fully and directly in {language}.
+    - DO NOT echo the question.
+    """
+
+    return system_prompt, user_prompt, final_query
+
+
+def _save_chat(patient_id: str, asked_by_role: str, question: str, answer: str) -> int:
+    """Persists a chat turn in its own session (used after a stream has finished)."""
+    db = SessionLocal()
+    try:
+        chat_entry = models.ChatHistory(
+            patient_id=patient_id,
+            asked_by_role=asked_by_role,
+            question=question,
+            answer=answer,
+        )
+        db.add(chat_entry)
+        db.commit()
+        return chat_entry.id
+    finally:
+        db.close()
+
+
+async def _generate_with_tts(
+    system_prompt: str,
+    user_prompt: str,
+    language: str,
+    client: httpx.AsyncClient,
+    patient_id: str,
+):
+    """
+    Streams the answer and starts synthesizing each finished sentence while
+    later ones are still being generated. Returns (answer_text, tts_tasks);
+    the tasks resolve to MP3 parts in sentence order.
+    """
+    sem = asyncio.Semaphore(TTS_CONCURRENCY)
+    tasks = []
+
+    async def speak(sentence: str):
+        key = _tts_key(language, sentence)
+        audio = _TTS_PART_CACHE.get(key)
+        if audio is not None:
+            _TTS_PART_CACHE.move_to_end(key)
+            return audio
+
+        async with sem:
+            audio = await asyncio.to_thread(text_to_speech_bytes, sentence, language)
+        if audio is not None:
+            _tts_part_cache_put(key, audio)
+        return audio
+
+    def submit(sentence: str):
+        sentence = sentence.strip()
+        if sentence:
+            tasks.append(asyncio.create_task(speak(sentence)))
+
+    parts = []
+    pending = ""
+    try:
+        async for delta in generate_text_stream(
+            system_prompt, user_prompt, max_tokens=600, client=client, cache_scope=patient_id
+        ):
+            parts.append(delta)
+            *sentences, pending = _SENTENCE_END.split(pending + delta)
+            for sentence in sentences:
+                submit(sentence)
+        submit(pending)
+    except BaseException:
+        for t in tasks:
+            t.cancel()
+        raise
+
+    return "".join(parts).strip(), tasks
+
+
+def _write_audio_file(audio_path: str, audio_parts):
+    if os.path.exists(audio_path):
+        return
+    # write under a unique name and rename so readers never see a partial file
+    tmp_path = f"{audio_path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "wb") as f:
+        for p in audio_parts:
+            f.write(p)
+    os.replace(tmp_path, audio_path)
+
+
+async def _save_tts_audio(tts_tasks, key: str, audio_path: str):
+    """
+    Background task: waits for the remaining sentence parts and stores them
+    as one MP3. Nothing is written if any part failed; the key is then
+    marked "failed" so the status endpoint can stop the client polling.
+    """
+    try:
+        audio_parts = await asyncio.gather(*tts_tasks)
+        if not audio_parts or any(p is None for p in audio_parts):
+            raise RuntimeError("a sentence could not be synthesized")
+        await asyncio.to_thread(_write_audio_file, audio_path, audio_parts)
+    except Exception as e:
+        print(f"TTS ERROR for {key}: {e}")
+        _set_tts_status(key, "failed")
+        return
+    _TTS_STATUS.pop(key, None)
+
+
+@router.get("/audio/{audio_key}")
+async def get_chat_audio_status(
+    audio_key: str,
+    current_user: CurrentUser = Depends(get_current_user),
+):
+    """
+    Status of an answer's audio (the file name in audio_url, without .mp3):
+    200 with the URL once written, 202 while it is still being synthesized,
+    404 if synthesis failed or the key is unknown.
+    """
+    if not _TTS_KEY_RE.match(audio_key):
+        raise HTTPException(status_code=404, detail="Audio not found")
+
+    if os.path.exists(os.path.join(AUDIO_RESPONSE_DIR, f"{audio_key}.mp3")):
+        return {"status": "ready", "audio_url": f"/storage/audio_responses/{audio_key}.mp3"}
+
+    status = _TTS_STATUS.get(audio_key)
+    if status == "pending":
+        return JSONResponse(status_code=202, content={"status": "pending"})
+    if status == "failed":
+        raise HTTPException(status_code=404, detail="Audio synthesis failed")
+    raise HTTPException(status_code=404, detail="Audio not found")
+
+
+@router.post("/{patient_id}", response_model=schemas.ChatOut)
+async def chat_with_patient_history(
+    patient_id: str,
+    request: Request,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(get_db),
+    current_user: CurrentUser = Depends(get_current_user),
+    llm_client: httpx.AsyncClient = Depends(get_llm_client),
+):
+    _ensure_chat_access(db, patient_id, current_user)
+
     content_type = request.headers.get("content-type", "") or ""
     question: Optional[str] = None
     upload_file: Optional[UploadFile] = None
@@ -130,10 +403,11 @@ async def chat_with_patient_history(
         try:
             if upload_file.content_type.startswith("audio/"):
                 tmp_path = os.path.join(TMP_AUDIO_DIR, f"{uuid.uuid4()}.wav")
-                with open(tmp_path, "wb") as f:
-                    f.write(await upload_file.read())
+                await save_upload_file(upload_file, tmp_path)
 
-                transcribed = transcribe_audio_file(tmp_path, language_hint=language)
+                transcribed = await asyncio.to_thread(
+                    transcribe_audio_file, tmp_path, language_hint=language
+                )
                 file_context = f"\n[Audio Transcript]: {transcribed}\n"
                 search_hint_from_file = transcribed
                 question = question or transcribed
@@ -151,79 +425,20 @@ async def chat_with_patient_history(
         except Exception as e:
             print("File handling error:", e)
 
-    base_question = question or "Analyze the uploaded content"
-    final_query = f"{base_question}\n{file_context}" if file_context else base_question
-
-    rag_query = question or search_hint_from_file or base_question
-    chunks = safe_search_patient_index(patient_id, query=rag_query, top_k=8)
-
-    context = "\n\n---\n\n".join(
-        [c["text"] for c in chunks if isinstance(c, dict) and c.get("text")]
-    ) if chunks else ""
-
-    if context:
-        context = (
-            "Patient records are ordered chronologically. "
-            "Recent findings appear later in the text.\n\n"
-            + context
-        )
-
-    if not context:
-        lab_context = build_lab_context(db, patient_id)
-
-        if lab_context:
-            context = (
-                "The following are structured lab results for this patient:\n\n"
-                + lab_context
-            )
-        else:
-            context = (
-                "No medical reports are available yet for this patient."
-            )
-
-    # --- UPDATED PROMPT TO STOP MIRRORING ---
-    system_prompt = f"""
-        You are a medical assistant.
-
-        CRITICAL LANGUAGE RULE (MANDATORY):
-        - You MUST reply ONLY in the following language: {language}
-        - If the user asks in Tamil, reply ONLY in Tamil.
-        - DO NOT repeat the user's question. Start your response directly.
-        - NEVER ask "What is your problem?" back to the user.
-
-        MEDICAL RULES:
-        - Use simple language if the user is a patient.
-        - Use medical terminology if the user is a doctor.
-        - Use ONLY the provided patient records.
-        - If information is missing, clearly say you do not have enough data.
-        - Do NOT prescribe medicines or dosages.
-    """
-
-    MAX_PROMPT_CHARS = 3500
-
-    if len(context) > MAX_PROMPT_CHARS:
-        context = context[-MAX_PROMPT_CHARS:]
-
-    if len(final_query) > 1000:
-        final_query = final_query[:1000]
-    
-    # FIXED: user_prompt defined BEFORE generate_text
-    user_prompt = f"""
-    Patient ID: {patient_id}
-
-    Patient record snippets:
-    {context if context else "[NO DATA AVAILABLE]"}
-
-    User query:
-    {final_query}
-
-    FINAL CHECK:
-    - Answer fully and directly in {language}.
-    - DO NOT echo the question.
-    """
+    system_prompt, user_prompt, final_query = await asyncio.to_thread(
+        _build_chat_prompts,
+        db,
+        patient_id,
+        question=question,
+        language=language,
+        file_context=file_context,
+        search_hint=search_hint_from_file,
+    )
 
     try:
-        answer_text = generate_text(system_prompt, user_prompt, max_tokens=600)
+        answer_text, tts_tasks = await _generate_with_tts(
+            system_prompt, user_prompt, language, llm_client, patient_id
+        )
     except Exception as e:
         print("LLM ERROR:", e)
         raise HTTPException(
@@ -231,11 +446,20 @@ async def chat_with_patient_history(
             detail="LLM temporarily unavailable. Please try again."
         )
 
+    # Audio finishes after the response is sent; the URL is deterministic,
+    # so the client can poll GET /chat/audio/{key} until it is ready or failed
     audio_url = None
-    audio_filename = f"{uuid.uuid4()}.mp3"
-    audio_path = os.path.join(AUDIO_RESPONSE_DIR, audio_filename)
-
-    if text_to_speech(answer_text, language, audio_path):
+    if tts_tasks:
+        audio_key = _tts_key(language, answer_text)
+        audio_filename = f"{audio_key}.mp3"
+        audio_path = os.path.join(AUDIO_RESPONSE_DIR, audio_filename)
+        if os.path.exists(audio_path):
+            # same answer was spoken before: reuse it, drop the new synthesis
+            for t in tts_tasks:
+                t.cancel()
+        else:
+            _set_tts_status(audio_key, "pending")
+            background_tasks.add_task(_save_tts_audio, tts_tasks, audio_key, audio_path)
         audio_url = f"/storage/audio_responses/{audio_filename}"
 
     chat_entry = models.ChatHistory(
@@ -263,24 +487,15 @@ async def chat_with_patient_history_audio(
     patient_id: str,
     file: UploadFile = File(...),
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user),
+    current_user: CurrentUser = Depends(get_current_user),
+    llm_client: httpx.AsyncClient = Depends(get_llm_client),
 ):
-    if current_user.role == "patient" and current_user.patient_id != patient_id:
-        raise HTTPException(status_code=403, detail="Not allowed")
-
-    if current_user.role not in ["doctor", "patient"]:
-        raise HTTPException(status_code=403, detail="Not allowed")
-
-    patient = db.query(models.Patient).filter(models.Patient.patient_id == patient_id).first()
-    if not patient:
-        raise HTTPException(status_code=404, detail="Patient not found")
+    _ensure_chat_access(db, patient_id, current_user)
 
     tmp_path = os.path.join(TMP_AUDIO_DIR, f"{uuid.uuid4()}.wav")
-    with open(tmp_path, "wb") as f:
-        f.write(await file.read())
-
     try:
-        question_text = transcribe_audio_file(tmp_path)
+        await save_upload_file(file, tmp_path)
+        question_text = await asyncio.to_thread(transcribe_audio_file, tmp_path)
     finally:
         try:
             os.remove(tmp_path)
@@ -290,10 +505,15 @@ async def chat_with_patient_history_audio(
     if not question_text:
         raise HTTPException(status_code=400, detail="Could not transcribe audio")
 
-    chunks = safe_search_patient_index(patient_id, query=question_text, top_k=8)
-    context = "\n\n---\n\n".join(
-        [c["text"] for c in chunks if isinstance(c, dict) and c.get("text")]
-    ) if chunks else ""
+    chunks = await asyncio.to_thread(
+        safe_search_patient_index, patient_id, query=question_text, top_k=8
+    )
+    MAX_CONTEXT_CHARS = 4000
+    context = tail_join(
+        [c["text"] for c in chunks if isinstance(c, dict) and c.get("text")] if chunks else [],
+        "\n\n---\n\n",
+        MAX_CONTEXT_CHARS,
+    )
 
     if not context:
         context = (
@@ -307,10 +527,6 @@ async def chat_with_patient_history_audio(
         "Do NOT repeat the user's question."
     )
 
-    MAX_CONTEXT_CHARS = 4000
-    if len(context) > MAX_CONTEXT_CHARS:
-        context = context[-MAX_CONTEXT_CHARS:]
-
     # FIXED: user_prompt defined BEFORE generate_text
     user_prompt = f"""
     Patient record snippets:
@@ -321,7 +537,9 @@ async def chat_with_patient_history_audio(
     """
 
     try:
-        answer_text = generate_text(system_prompt, user_prompt, max_tokens=600)
+        answer_text = await generate_text(
+            system_prompt, user_prompt, max_tokens=600, client=llm_client, cache_scope=patient_id
+        )
     except Exception as e:
         print("LLM ERROR:", e)
         raise HTTPException(
@@ -346,4 +564,45 @@ async def chat_with_patient_history_audio(
         question=chat_entry.question,
         answer=chat_entry.answer,
         created_at=chat_entry.created_at,
-    )
\ No newline at end of file
+    )
+
+
+@router.post("/{patient_id}/stream")
+async def chat_with_patient_history_stream(
+    patient_id: str,
+    body: schemas.ChatRequest,
+    db: Session = Depends(get_db),
+    current_user: CurrentUser = Depends(get_current_user),
+    llm_client: httpx.AsyncClient = Depends(get_llm_client),
+):
+    """
+    Same as POST /chat/{patient_id} (JSON body) but streams the answer as
+    server-sent events: {"delta": ...} per chunk, then {"done": true, "id": ...}.
+    """
+    _ensure_chat_access(db, patient_id, current_user)
+
+    question = body.question.strip()
+    if not question:
+        raise HTTPException(status_code=400, detail="Question or file required")
+
+    system_prompt, user_prompt, final_query = await asyncio.to_thread(
+        _build_chat_prompts,
+        db, patient_id, question=question, language=body.language
+    )
+    asked_by_role = current_user.role
+
+    async def events():
+        parts = []
+        async for delta in generate_text_stream(
+            system_prompt, user_prompt, max_tokens=600, client=llm_client, cache_scope=patient_id
+        ):
+            parts.append(delta)
+            yield sse_event({"delta": delta})
+
+        answer_text = "".join(parts).strip()
+        chat_id = await asyncio.to_thread(
+            _save_chat, patient_id, asked_by_role, final_query, answer_text
+        )
+        yield sse_event({"done": True, "id": chat_id})
+
+    return StreamingResponse(events(), media_type="text/event-stream")
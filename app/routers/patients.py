@@ -1,9 +1,9 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 
 from .. import models, schemas
-from ..deps import get_db
+from ..deps import get_db, PAGE_SIZE_DEFAULT, PAGE_SIZE_MAX, NEXT_CURSOR_HEADER
 
 router = APIRouter(prefix="/patients", tags=["patients"])
 
@@ -28,8 +28,24 @@ def create_patient(patient: schemas.PatientCreate, db: Session = Depends(get_db)
 
 
 @router.get("/", response_model=List[schemas.PatientOut])
-def list_patients(db: Session = Depends(get_db)):
-    return db.query(models.Patient).all()
+def list_patients(
+    response: Response,
+    limit: int = Query(PAGE_SIZE_DEFAULT, ge=1, le=PAGE_SIZE_MAX),
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_db),
+):
+    """
+    Patients ordered by patient_id, one page at a time. Pass the
+    X-Next-Cursor header of a response as `cursor` to get the next page.
+    """
+    query = db.query(models.Patient).order_by(models.Patient.patient_id)
+    if cursor:
+        query = query.filter(models.Patient.patient_id > cursor)
+
+    patients = query.limit(limit).all()
+    if len(patients) == limit:
+        response.headers[NEXT_CURSOR_HEADER] = patients[-1].patient_id
+    return patients
 
 
 @router.get("/{patient_id}", response_model=schemas.PatientOut)
@@ -1,23 +1,31 @@
 import os
-import csv
-import io
+import asyncio
+import uuid
 import json
 from datetime import datetime
-from typing import List
+from typing import List, Optional, Tuple
 
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form
+import httpx
+import pandas as pd
+
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Query, Response
+from sqlalchemy import inspect, or_, tuple_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
 from .. import models, schemas
-from ..deps import get_db
-from .auth import get_current_user
+from ..deps import get_db, get_llm_client, PAGE_SIZE_DEFAULT, PAGE_SIZE_MAX, NEXT_CURSOR_HEADER
+from ..utils_db import bulk_add_reports
+from .auth import CurrentUser, get_current_user
 
-from ..utils_text import extract_text_from_file, calculate_content_hash
+from ..utils_text import extract_text_from_file, save_upload_file
 from ..utils_preprocess import clean_medical_text
 from ..utils_image import extract_image_embedding, generate_image_caption
 
 from ..rag import (
     add_text_to_index,
+    add_texts_to_index,
     add_image_to_index,
     search_patient_index,
     search_by_vector,
@@ -32,6 +40,137 @@ REPORTS_DIR = os.path.join("storage", "reports")
 os.makedirs(REPORTS_DIR, exist_ok=True)
 
 
+def _remove_quietly(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+IMAGE_DOCTOR_PROMPT = "You are a radiologist. Generate a concise clinical impression."
+IMAGE_PATIENT_PROMPT = "Explain the findings in simple language for a patient."
+IMAGE_SUMMARY_PROMPT = (
+    "You are a radiologist. Return a JSON object with exactly two string keys: "
+    '"doctor": a concise clinical impression of the findings; '
+    '"patient": an explanation of the findings in simple language for a patient.'
+)
+
+
+async def _summarize_image_findings(findings: str, patient_id: str, client: httpx.AsyncClient):
+    """
+    (doctor_summary, patient_summary) for the same findings from a single
+    JSON-mode LLM call; falls back to the two separate prompts if the reply
+    isn't usable.
+    """
+    reply = await generate_text(
+        IMAGE_SUMMARY_PROMPT,
+        findings,
+        max_tokens=500,
+        client=client,
+        json_output=True,
+        cache_scope=patient_id,
+    )
+    try:
+        data = json.loads(reply)
+        doctor, patient = data["doctor"], data["patient"]
+        if isinstance(doctor, str) and isinstance(patient, str) and doctor.strip() and patient.strip():
+            return doctor.strip(), patient.strip()
+    except (ValueError, KeyError, TypeError):
+        pass
+
+    return await asyncio.gather(
+        generate_text(
+            IMAGE_DOCTOR_PROMPT, findings, max_tokens=300, client=client, cache_scope=patient_id
+        ),
+        generate_text(
+            IMAGE_PATIENT_PROMPT, findings, max_tokens=200, client=client, cache_scope=patient_id
+        ),
+    )
+
+
+def _parse_lab_csv(fileobj) -> List[Tuple[str, dict]]:
+    """
+    (patient_id, {test: float}) per CSV row, parsed and cast to float by
+    pandas' C reader. Rows without a patient_id and empty cells are skipped;
+    a non-numeric lab value raises ValueError as float() did.
+    """
+    try:
+        # only empty cells are missing, as with csv.DictReader: a patient_id
+        # like "NA" or "null" is kept and a lab value like that is an error
+        df = pd.read_csv(
+            fileobj, dtype={"patient_id": "string"}, keep_default_na=False, na_values=[""]
+        )
+    except pd.errors.EmptyDataError:
+        return []
+
+    if "patient_id" not in df.columns:
+        return []
+    df = df[df["patient_id"].fillna("") != ""]
+
+    lab_columns = [c for c in df.columns if c != "patient_id"]
+    records = df[lab_columns].astype(float).to_dict("records")
+
+    return [
+        # NaN (empty cell) is the only value not equal to itself
+        (patient_id, {k: v for k, v in record.items() if v == v})
+        for patient_id, record in zip(df["patient_id"].tolist(), records)
+    ]
+
+
+# Set once ux_reports_patient_hash is seen; the index is never dropped
+_unique_hash_index = False
+
+
+def _has_unique_hash_index(db: Session) -> bool:
+    """
+    Whether the unique (patient_id, content_hash) index exists. migrate_db
+    can't create it while legacy duplicates remain in the table.
+    """
+    global _unique_hash_index
+    if not _unique_hash_index:
+        indexes = inspect(db.get_bind()).get_indexes("reports")
+        _unique_hash_index = any(i["name"] == "ux_reports_patient_hash" for i in indexes)
+    return _unique_hash_index
+
+
+def _reject_duplicate(db_report: models.Report):
+    _remove_quietly(db_report.file_path)
+    raise HTTPException(
+        status_code=400,
+        detail="Duplicate report detected for this patient"
+    )
+
+
+def _insert_uploaded_report(db: Session, db_report: models.Report):
+    """
+    Inserts a file report. Duplicates are rejected by the unique
+    (patient_id, content_hash) index in the same statement, which also
+    covers two identical uploads racing each other. Without the index,
+    falls back to looking for a duplicate before the insert.
+    """
+    if not _has_unique_hash_index(db):
+        duplicate = (
+            db.query(models.Report.id)
+            .filter(
+                models.Report.patient_id == db_report.patient_id,
+                models.Report.content_hash == db_report.content_hash,
+            )
+            .first()
+        )
+        if duplicate:
+            _reject_duplicate(db_report)
+
+    db.add(db_report)
+    try:
+        db.commit()
+    except IntegrityError as e:
+        db.rollback()
+        if "content_hash" not in str(e.orig):
+            raise
+        _reject_duplicate(db_report)
+    db.refresh(db_report)
+
+
 # =========================================================
 # SINGLE REPORT UPLOAD
 # Supports:
@@ -46,26 +185,23 @@ async def upload_report(
     extracted_data: str | None = Form(None),
     file: UploadFile | None = File(None),
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user),
+    current_user: CurrentUser = Depends(get_current_user),
+    llm_client: httpx.AsyncClient = Depends(get_llm_client),
 ):
     # ---------------------------------------------------------
     # 0) Ensure patient exists
     # ---------------------------------------------------------
-    patient = (
-        db.query(models.Patient)
-        .filter(models.Patient.patient_id == patient_id)
-        .first()
-    )
-    if not patient:
-        patient = models.Patient(
+    db.execute(
+        sqlite_insert(models.Patient)
+        .values(
             patient_id=patient_id,
             name=f"Patient {patient_id}",
             dob="01/01/2000",
             gender="Unknown"
         )
-        db.add(patient)
-        db.commit()
-        db.refresh(patient)
+        .on_conflict_do_nothing(index_elements=["patient_id"])
+    )
+    db.commit()
 
     # ---------------------------------------------------------
     # 1) LAB JSON (no file)
@@ -91,7 +227,9 @@ async def upload_report(
         db.commit()
         db.refresh(db_report)
 
-        add_text_to_index(patient_id, db_report.id, db_report.parsed_text)
+        await asyncio.to_thread(
+            add_text_to_index, patient_id, db_report.id, db_report.parsed_text
+        )
         return db_report
 
     # ---------------------------------------------------------
@@ -103,36 +241,26 @@ async def upload_report(
             detail="File required for text/image reports"
         )
 
-    file_bytes = await file.read()
-    content_hash = calculate_content_hash(file_bytes)
+    patient_dir = os.path.join(REPORTS_DIR, patient_id)
+    os.makedirs(patient_dir, exist_ok=True)
 
-    # Duplicate prevention
-    duplicate = (
-        db.query(models.Report)
-        .filter(
-            models.Report.patient_id == patient_id,
-            models.Report.content_hash == content_hash
-        )
-        .first()
-    )
-    if duplicate:
-        raise HTTPException(
-            status_code=400,
-            detail="Duplicate report detected for this patient"
-        )
+    tmp_path = os.path.join(patient_dir, f".upload_{uuid.uuid4().hex}.part")
+    try:
+        content_hash = await save_upload_file(file, tmp_path)
+    except Exception:
+        _remove_quietly(tmp_path)
+        raise
 
     ext = os.path.splitext(file.filename)[1].lower()
     timestamp = datetime.utcnow().strftime("%Y%m%d%H%M%S")
-    filename = f"{patient_id}_{timestamp}{ext}"
-
-    patient_dir = os.path.join(REPORTS_DIR, patient_id)
-    os.makedirs(patient_dir, exist_ok=True)
+    # unique per upload: a duplicate rejected at INSERT time removes its own
+    # file, never the original's (uploads in the same second share a timestamp)
+    filename = f"{patient_id}_{timestamp}_{uuid.uuid4().hex}{ext}"
 
     file_path = os.path.join(patient_dir, filename)
-    with open(file_path, "wb") as f:
-        f.write(file_bytes)
+    os.replace(tmp_path, file_path)
 
-    raw_text = extract_text_from_file(file_path)
+    raw_text = await asyncio.to_thread(extract_text_from_file, file_path, content_hash)
 
     # ---------------------------------------------------------
     # 3) Auto-detect lab files (.json / .csv)
@@ -152,17 +280,15 @@ async def upload_report(
             created_at=datetime.utcnow(),
         )
 
-        db.add(db_report)
-        db.commit()
-        db.refresh(db_report)
+        _insert_uploaded_report(db, db_report)
 
-        add_text_to_index(patient_id, db_report.id, parsed_text)
+        await asyncio.to_thread(add_text_to_index, patient_id, db_report.id, parsed_text)
         return db_report
 
     # ---------------------------------------------------------
     # 4) TEXT / IMAGE REPORT
     # ---------------------------------------------------------
-    parsed_text = clean_medical_text(raw_text)
+    parsed_text = await asyncio.to_thread(clean_medical_text, raw_text)
     is_image = ext in [".png", ".jpg", ".jpeg"]
 
     db_report = models.Report(
@@ -176,36 +302,27 @@ async def upload_report(
         created_at=datetime.utcnow(),
     )
 
-    db.add(db_report)
-    db.commit()
-    db.refresh(db_report)
+    _insert_uploaded_report(db, db_report)
 
     # ---------------------------------------------------------
     # 5) IMAGE: embeddings + RAG + LLM summaries
     # ---------------------------------------------------------
     if is_image:
-        embedding = extract_image_embedding(file_path)
-        add_image_to_index(patient_id, db_report.id, embedding)
+        embedding = await extract_image_embedding(file_path)
+        # written together with the summary text added below
+        await asyncio.to_thread(
+            add_image_to_index, patient_id, db_report.id, embedding, flush=False
+        )
 
-        related = search_by_vector(patient_id, embedding, top_k=5)
+        related = await asyncio.to_thread(search_by_vector, patient_id, embedding, top_k=5)
         retrieved_text = "\n\n".join(
             r["text"] for r in related if r.get("type") == "text"
         )
 
         caption = generate_image_caption(file_path)
 
-        doctor_prompt = (
-            "You are a radiologist. Generate a concise clinical impression."
-        )
-        doctor_input = f"{caption}\n\n{parsed_text}\n\n{retrieved_text}"
-
-        patient_prompt = (
-            "Explain the findings in simple language for a patient."
-        )
-        patient_input = doctor_input
-
-        doctor_summary = generate_text(doctor_prompt, doctor_input, max_tokens=300)
-        patient_summary = generate_text(patient_prompt, patient_input, max_tokens=200)
+        findings = f"{caption}\n\n{parsed_text}\n\n{retrieved_text}"
+        doctor_summary, patient_summary = await _summarize_image_findings(findings, patient_id, llm_client)
 
         parsed_text += (
             f"\n\n[DOCTOR SUMMARY]\n{doctor_summary}\n\n"
@@ -215,11 +332,11 @@ async def upload_report(
         db_report.parsed_text = parsed_text
         db.commit()
 
-        add_text_to_index(patient_id, db_report.id, parsed_text)
+        await asyncio.to_thread(add_text_to_index, patient_id, db_report.id, parsed_text)
 
     else:
         if parsed_text:
-            add_text_to_index(patient_id, db_report.id, parsed_text)
+            await asyncio.to_thread(add_text_to_index, patient_id, db_report.id, parsed_text)
 
     return db_report
 
@@ -231,7 +348,7 @@ async def upload_report(
 async def upload_lab_csv(
     file: UploadFile = File(...),
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user),
+    current_user: CurrentUser = Depends(get_current_user),
 ):
     if current_user.role not in ["lab_tech", "lab technician", "admin"]:
         raise HTTPException(status_code=403, detail="Lab access required")
@@ -239,38 +356,31 @@ async def upload_lab_csv(
     if not file.filename.endswith(".csv"):
         raise HTTPException(status_code=400, detail="Only CSV files are supported")
 
-    decoded = (await file.read()).decode("utf-8")
-    reader = csv.DictReader(io.StringIO(decoded))
-
-    created = 0
-    for row in reader:
-        patient_id = row.get("patient_id")
-        if not patient_id:
-            continue
-
-        extracted_data = {
-            k: float(v)
-            for k, v in row.items()
-            if k != "patient_id" and v not in ("", None)
-        }
-
-        report = models.Report(
-            patient_id=patient_id,
-            uploaded_by=current_user.id,
-            uploader_role=current_user.role,
-            report_type="lab",
-            extracted_data=extracted_data,
-            parsed_text=json.dumps(extracted_data, indent=2),
-            file_path=f"labcsv://{patient_id}/{datetime.utcnow().isoformat()}",
-            created_at=datetime.utcnow(),
-        )
-
-        db.add(report)
-        db.commit()
-        db.refresh(report)
-
-        add_text_to_index(patient_id, report.id, report.parsed_text)
-        created += 1
+    # Every row of the file lands in the same transaction, so they share one timestamp
+    uploaded_at = datetime.utcnow()
+    rows = []
+    for patient_id, extracted_data in await asyncio.to_thread(_parse_lab_csv, file.file):
+        rows.append({
+            "patient_id": patient_id,
+            "uploaded_by": current_user.id,
+            "uploader_role": current_user.role,
+            "report_type": "lab",
+            "extracted_data": extracted_data,
+            "parsed_text": json.dumps(extracted_data, indent=2),
+            "file_path": f"labcsv://{patient_id}/{uploaded_at.isoformat()}",
+            "created_at": uploaded_at,
+        })
+
+    # One INSERT + commit for the whole file, then one index write per patient
+    report_ids = bulk_add_reports(db, rows)
+    await asyncio.to_thread(
+        add_texts_to_index,
+        [
+            (row["patient_id"], report_id, row["parsed_text"])
+            for row, report_id in zip(rows, report_ids)
+        ],
+    )
+    created = len(report_ids)
 
     return {
         "message": "CSV lab upload completed",
@@ -284,15 +394,67 @@ async def upload_lab_csv(
 @router.get("/by-patient/{patient_id}", response_model=List[schemas.ReportOut])
 def get_reports_for_patient(
     patient_id: str,
+    response: Response,
+    limit: int = Query(PAGE_SIZE_DEFAULT, ge=1, le=PAGE_SIZE_MAX),
+    cursor: Optional[str] = None,
+    include_text: bool = False,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user),
+    current_user: CurrentUser = Depends(get_current_user),
 ):
-    return (
-        db.query(models.Report)
+    """
+    Newest reports first, one page at a time. Pass the X-Next-Cursor header
+    of a response as `cursor` to get the next page. parsed_text can be large
+    and is only returned with include_text=true.
+    """
+    columns = [
+        models.Report.id,
+        models.Report.patient_id,
+        models.Report.uploader_role,
+        models.Report.file_path,
+        models.Report.created_at,
+        models.Report.extracted_data,
+        models.Report.report_type,
+        models.Report.source_label,
+    ]
+    if include_text:
+        columns.append(models.Report.parsed_text)
+
+    query = (
+        db.query(*columns)
         .filter(models.Report.patient_id == patient_id)
-        .order_by(models.Report.created_at.desc())
-        .all()
+        .order_by(models.Report.created_at.desc(), models.Report.id.desc())
     )
+    # Legacy rows with a NULL created_at sort last (SQLite orders NULLs
+    # lowest); their cursor has an empty timestamp
+    if cursor:
+        created_at, report_id = _parse_report_cursor(cursor)
+        if created_at is None:
+            query = query.filter(
+                models.Report.created_at.is_(None), models.Report.id < report_id
+            )
+        else:
+            query = query.filter(or_(
+                tuple_(models.Report.created_at, models.Report.id) < (created_at, report_id),
+                models.Report.created_at.is_(None),
+            ))
+
+    rows = query.limit(limit).all()
+    if len(rows) == limit:
+        last = rows[-1]
+        created_at = last.created_at.isoformat() if last.created_at else ""
+        response.headers[NEXT_CURSOR_HEADER] = f"{created_at}_{last.id}"
+
+    return [{"parsed_text": None, **row._mapping} for row in rows]
+
+
+def _parse_report_cursor(cursor: str):
+    created_at, sep, report_id = cursor.rpartition("_")
+    try:
+        if not sep:
+            raise ValueError(cursor)
+        return (datetime.fromisoformat(created_at) if created_at else None), int(report_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
 
 
 @router.get("/search/{patient_id}")
@@ -300,7 +462,7 @@ def search_reports_for_patient(
     patient_id: str,
     query: str,
     top_k: int = 5,
-    current_user: models.User = Depends(get_current_user),
+    current_user: CurrentUser = Depends(get_current_user),
 ):
     results = search_patient_index(patient_id, query, top_k)
     return {"patient_id": patient_id, "query": query, "results": results}
@@ -309,7 +471,7 @@ def search_reports_for_patient(
 @router.get("/debug-index/{patient_id}")
 def debug_patient_index(
     patient_id: str,
-    current_user: models.User = Depends(get_current_user),
+    current_user: CurrentUser = Depends(get_current_user),
 ):
     return get_patient_index_stats(patient_id)
 
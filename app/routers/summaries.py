@@ -1,30 +1,49 @@
-import json
+import asyncio
+import httpx
+from typing import Literal
+
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 
 from .. import models, schemas
-from ..deps import get_db
-from .auth import get_current_user
-from ..llm import generate_text
+from ..deps import get_db, get_llm_client, sse_event
+from .auth import CurrentUser, get_current_user
+from ..llm import generate_text, generate_text_stream
+from ..utils_text import tail_join
 
 router = APIRouter(prefix="/summary", tags=["summary"])
 
+# The context is cut to its last 8000 chars anyway, so older reports
+# beyond this many would never reach the LLM
+CONTEXT_REPORT_LIMIT = 50
+
 
 # --------------------------------------------------
 # Helpers
 # --------------------------------------------------
-def _build_lab_context(reports):
-    blocks = []
-    for r in reports:
-        if r.report_type == "lab" and r.extracted_data:
-            ts = r.created_at.strftime("%Y-%m-%d")
-            blocks.append(
-                f"[LAB REPORT | {ts}]\n" +
-                json.dumps(r.extracted_data, indent=2)
-            )
-    return "\n\n---\n\n".join(blocks)
+def _load_context_reports(db: Session, patient_id: str):
+    """
+    Only the columns the context builders read, for the newest
+    CONTEXT_REPORT_LIMIT reports, returned oldest first.
+    """
+    rows = (
+        db.query(
+            models.Report.report_type,
+            models.Report.created_at,
+            models.Report.parsed_text,
+            models.Report.extracted_data,
+        )
+        .filter(models.Report.patient_id == patient_id)
+        .order_by(models.Report.created_at.desc())
+        .limit(CONTEXT_REPORT_LIMIT)
+        .all()
+    )
+    rows.reverse()
+    return rows
+
 
-def _lab_report_to_text(report: models.Report) -> str:
+def _lab_report_to_text(report) -> str:
     """
     Converts structured lab data into readable text for LLMs.
     """
@@ -62,15 +81,11 @@ def _build_context_from_reports(reports):
     if not texts:
         return ""
 
-    full = "\n\n---\n\n".join(texts)
-
-    if len(full) > 8000:
-        full = full[-8000:]
-
-    return full
+    # Only the newest 8000 chars are kept; older texts are never joined
+    return tail_join(texts, "\n\n---\n\n", 8000)
 
 
-def _generate_patient_summary(patient_id: str, context: str):
+def _patient_summary_prompts(patient_id: str, context: str):
     system_prompt = (
         "You are a medical assistant that explains a patient's health record "
         "in simple, clear, and reassuring language. Avoid medical jargon where possible."
@@ -89,10 +104,10 @@ def _generate_patient_summary(patient_id: str, context: str):
     - Do NOT prescribe medications.
     """
 
-    return generate_text(system_prompt, user_prompt, max_tokens=400)
+    return system_prompt, user_prompt
 
 
-def _generate_doctor_summary(patient_id: str, context: str):
+def _doctor_summary_prompts(patient_id: str, context: str):
     system_prompt = (
         "You are a clinical decision-support assistant generating concise, "
         "medically accurate summaries strictly from patient records."
@@ -110,19 +125,32 @@ Task:
 - Do not speculate beyond the text.
 """
 
-    return generate_text(system_prompt, user_prompt, max_tokens=400)
+    return system_prompt, user_prompt
 
 
-# --------------------------------------------------
-# Patient summary
-# --------------------------------------------------
-@router.get("/{patient_id}/patient", response_model=schemas.SummaryResponse)
-def get_patient_friendly_summary(
-    patient_id: str,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user),
-):
-    if current_user.role == "patient" and current_user.patient_id != patient_id:
+SUMMARY_PROMPTS = {
+    "patient": _patient_summary_prompts,
+    "doctor": _doctor_summary_prompts,
+}
+
+# Returned instead of an LLM summary when there is nothing to summarize
+NO_CONTEXT_SUMMARY = {
+    "patient": (
+        "No textual medical reports are available yet. "
+        "Your lab results are recorded, but a written summary requires "
+        "doctor notes or diagnostic reports."
+    ),
+    "doctor": "No textual reports available yet for this patient.",
+}
+
+
+def _load_summary_context(db: Session, patient_id: str, current_user, summary_type: str) -> str:
+    """Access checks + patient lookup, then the report context for the summary."""
+    if (
+        summary_type == "patient"
+        and current_user.role == "patient"
+        and current_user.patient_id != patient_id
+    ):
         raise HTTPException(status_code=403, detail="Not allowed")
 
     if current_user.role == "lab_tech":
@@ -135,27 +163,35 @@ def get_patient_friendly_summary(
     if not patient:
         raise HTTPException(status_code=404, detail="Patient not found")
 
-    reports = (
-        db.query(models.Report)
-        .filter(models.Report.patient_id == patient_id)
-        .order_by(models.Report.created_at.asc())
-        .all()
-    )
+    reports = _load_context_reports(db, patient_id)
+    return _build_context_from_reports(reports)
 
-    context = _build_context_from_reports(reports)
-
-    context = _build_context_from_reports(reports)
-    lab_context = _build_lab_context(reports)
-    full_context = "\n\n".join([context, lab_context]).strip()
 
+async def _generate_summary(
+    patient_id: str, summary_type: str, context: str, client: httpx.AsyncClient
+) -> str:
     if not context:
-        summary_text = (
-            "No textual medical reports are available yet. "
-            "Your lab results are recorded, but a written summary requires "
-            "doctor notes or diagnostic reports."
-        )
-    else:
-        summary_text = _generate_patient_summary(patient_id, context)
+        return NO_CONTEXT_SUMMARY[summary_type]
+    system_prompt, user_prompt = SUMMARY_PROMPTS[summary_type](patient_id, context)
+    return await generate_text(
+        system_prompt, user_prompt, max_tokens=400, client=client, cache_scope=patient_id
+    )
+
+
+# --------------------------------------------------
+# Patient summary
+# --------------------------------------------------
+@router.get("/{patient_id}/patient", response_model=schemas.SummaryResponse)
+async def get_patient_friendly_summary(
+    patient_id: str,
+    db: Session = Depends(get_db),
+    current_user: CurrentUser = Depends(get_current_user),
+    llm_client: httpx.AsyncClient = Depends(get_llm_client),
+):
+    context = await asyncio.to_thread(
+        _load_summary_context, db, patient_id, current_user, "patient"
+    )
+    summary_text = await _generate_summary(patient_id, "patient", context, llm_client)
 
     return schemas.SummaryResponse(
         patient_id=patient_id,
@@ -168,41 +204,56 @@ def get_patient_friendly_summary(
 # Doctor summary
 # --------------------------------------------------
 @router.get("/{patient_id}/doctor", response_model=schemas.SummaryResponse)
-def get_doctor_friendly_summary(
+async def get_doctor_friendly_summary(
     patient_id: str,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user),
+    current_user: CurrentUser = Depends(get_current_user),
+    llm_client: httpx.AsyncClient = Depends(get_llm_client),
 ):
-    if current_user.role == "lab_tech":
-        raise HTTPException(status_code=403, detail="Lab technicians cannot request summaries")
-
-    patient = db.query(models.Patient).filter(
-        models.Patient.patient_id == patient_id
-    ).first()
-
-    if not patient:
-        raise HTTPException(status_code=404, detail="Patient not found")
-
-    reports = (
-        db.query(models.Report)
-        .filter(models.Report.patient_id == patient_id)
-        .order_by(models.Report.created_at.asc())
-        .all()
+    context = await asyncio.to_thread(
+        _load_summary_context, db, patient_id, current_user, "doctor"
     )
-
-    context = _build_context_from_reports(reports)
-    context = _build_context_from_reports(reports)
-    lab_context = _build_lab_context(reports)
-
-    full_context = "\n\n".join([context, lab_context]).strip()
-
-    if not context:
-        summary_text = "No textual reports available yet for this patient."
-    else:
-        summary_text = _generate_doctor_summary(patient_id, context)
+    summary_text = await _generate_summary(patient_id, "doctor", context, llm_client)
 
     return schemas.SummaryResponse(
         patient_id=patient_id,
         summary_type="doctor",
         summary=summary_text,
-    )
\ No newline at end of file
+    )
+
+
+# --------------------------------------------------
+# Streaming summaries
+# --------------------------------------------------
+@router.get("/{patient_id}/{summary_type}/stream")
+async def stream_summary(
+    patient_id: str,
+    summary_type: Literal["patient", "doctor"],
+    db: Session = Depends(get_db),
+    current_user: CurrentUser = Depends(get_current_user),
+    llm_client: httpx.AsyncClient = Depends(get_llm_client),
+):
+    """
+    Same summary as GET /summary/{patient_id}/{summary_type}, streamed as
+    server-sent events: {"delta": ...} per chunk, then {"done": true}.
+    """
+    context = await asyncio.to_thread(
+        _load_summary_context, db, patient_id, current_user, summary_type
+    )
+
+    async def events():
+        if not context:
+            yield sse_event({"delta": NO_CONTEXT_SUMMARY[summary_type]})
+        else:
+            system_prompt, user_prompt = SUMMARY_PROMPTS[summary_type](patient_id, context)
+            async for delta in generate_text_stream(
+                system_prompt,
+                user_prompt,
+                max_tokens=400,
+                client=llm_client,
+                cache_scope=patient_id,
+            ):
+                yield sse_event({"delta": delta})
+        yield sse_event({"done": True, "summary_type": summary_type})
+
+    return StreamingResponse(events(), media_type="text/event-stream")
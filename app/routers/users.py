@@ -4,7 +4,7 @@ from typing import List
 
 from .. import models, schemas
 from ..deps import get_db
-from .auth import get_current_user
+from .auth import CurrentUser, get_current_user
 
 router = APIRouter(prefix="/users", tags=["users"])
 
@@ -12,7 +12,7 @@ router = APIRouter(prefix="/users", tags=["users"])
 @router.get("/", response_model=List[schemas.UserOut])
 def list_users(
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user),
+    current_user: CurrentUser = Depends(get_current_user),
 ):
     # Simple guard: only doctors (or some 'admin' role) can see all users
     if current_user.role not in ("doctor", "admin"):
@@ -63,7 +63,7 @@ class ReportOut(BaseModel):
     uploader_role: str
     file_path: Optional[str] = None
     parsed_text: Optional[str]
-    created_at: datetime
+    created_at: Optional[datetime] = None  # NULL on some legacy rows
     extracted_data: Optional[dict] = None
     report_type: Optional[str]
     source_label: Optional[str]
@@ -105,6 +105,7 @@ class ChatOut(BaseModel):
     question: str
     answer: str
     created_at: datetime
+    audio_url: Optional[str] = None
 
     class Config:
         orm_mode = True
@@ -112,6 +113,7 @@ class ChatOut(BaseModel):
 
 class ChatRequest(BaseModel):
     question: str
+    language: str = "English"
 
 
 class SummaryResponse(BaseModel):
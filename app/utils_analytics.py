@@ -1,7 +1,15 @@
+import pandas as pd
+
+
 def safe_dict(val):
+    # JSON columns come back as plain dicts; skip the isinstance MRO walk for those
+    if type(val) is dict:
+        return val
     return val if isinstance(val, dict) else {}
 
 def safe_list(val):
+    if type(val) is list:
+        return val
     return val if isinstance(val, list) else []
 
 def safe_number(val, default=0):
@@ -9,3 +17,31 @@ def safe_number(val, default=0):
 
 def safe_str(val, default=""):
     return val if isinstance(val, str) else default
+
+
+def lab_rows_to_df(rows) -> pd.DataFrame:
+    """
+    One row per (test, value) pair across lab `extracted_data` dicts.
+    Columns are object dtype so values come back as plain Python numbers.
+    """
+    pairs = [(k, v) for row in rows for k, v in safe_dict(row).items()]
+    return pd.DataFrame(pairs, columns=["test", "value"], dtype=object)
+
+
+def lab_trends_from_rows(rows):
+    """{test_name: [values...]} in row order from lab `extracted_data` dicts."""
+    df = lab_rows_to_df(rows)
+    if df.empty:
+        return {}
+    return df.groupby("test", sort=False)["value"].apply(list).to_dict()
+
+
+def lab_trends_from_reports(reports):
+    """
+    Lab trends over report-like objects (ORM rows or column tuples with
+    report_type / extracted_data), shared by the analytics router and
+    the registry lab module.
+    """
+    return lab_trends_from_rows(
+        r.extracted_data for r in reports if r.report_type == "lab"
+    )
@@ -1,8 +1,31 @@
+import io
 import os
-from faster_whisper import WhisperModel
+import json
+import threading
+from typing import Optional
+
+import av
+import numpy as np
+import onnxruntime
+import torch
+from filelock import FileLock
+from faster_whisper import WhisperModel, BatchedInferencePipeline, decode_audio
 from gtts import gTTS
+from piper import PiperVoice
+from piper.config import PiperConfig
 
 ASR_MODEL_NAME = "tiny"
+ASR_MODEL_HF = "openai/whisper-tiny"
+ASR_MODEL_DIR = os.getenv("ASR_MODEL_DIR", os.path.join("models", "whisper-tiny-int8"))
+ASR_BATCH_SIZE = 8
+# Greedy decoding: transcription is on the interactive chat path
+ASR_BEAM_SIZE = 1
+ASR_SAMPLE_RATE = 16000
+# Optional CPU backend: an optimum ONNX export of openai/whisper-tiny whose
+# encoder/decoder graphs were rewritten in place with
+# onnxruntime.quantization.matmul_nbits_quantizer (--bits 4 --block_size 32).
+# Used when the directory exists and there is no GPU; otherwise faster-whisper.
+ASR_ONNX_DIR = os.getenv("ASR_ONNX_DIR", os.path.join("models", "whisper-tiny-onnx-int4"))
 _whisper_model = None
 
 LANG_CODES = {
@@ -12,26 +35,212 @@ LANG_CODES = {
     "Telugu": "te"
 }
 
+def _ensure_int8_model() -> str:
+    """
+    Converts the HF Whisper checkpoint to int8 CTranslate2 weights once, so
+    later boots load them as-is instead of quantizing on every start.
+    A file lock keeps multiple uvicorn workers from converting at the same
+    time. Falls back to the hub model if the conversion fails.
+    """
+    model_bin = os.path.join(ASR_MODEL_DIR, "model.bin")
+    if os.path.isfile(model_bin):
+        return ASR_MODEL_DIR
+
+    try:
+        os.makedirs(os.path.dirname(ASR_MODEL_DIR) or ".", exist_ok=True)
+        with FileLock(ASR_MODEL_DIR + ".lock"):
+            if not os.path.isfile(model_bin):
+                from ctranslate2.converters import TransformersConverter
+
+                tmp_dir = ASR_MODEL_DIR + ".tmp"
+                TransformersConverter(
+                    ASR_MODEL_HF,
+                    copy_files=["tokenizer.json", "preprocessor_config.json"],
+                ).convert(tmp_dir, quantization="int8", force=True)
+                os.replace(tmp_dir, ASR_MODEL_DIR)
+        return ASR_MODEL_DIR
+    except Exception as e:
+        print(f"ASR model conversion failed, using {ASR_MODEL_NAME}: {e}")
+        return ASR_MODEL_NAME
+
+
+def _ort_session_options() -> onnxruntime.SessionOptions:
+    options = onnxruntime.SessionOptions()
+    options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+    options.intra_op_num_threads = os.cpu_count() or 0
+    return options
+
+
+def _load_onnx_asr():
+    """int4 ONNX Runtime Whisper behind a transformers ASR pipeline (30 s chunks)."""
+    from optimum.onnxruntime import ORTModelForSpeechSeq2Seq
+    from transformers import WhisperProcessor, pipeline
+
+    model = ORTModelForSpeechSeq2Seq.from_pretrained(
+        ASR_ONNX_DIR,
+        provider="CPUExecutionProvider",
+        session_options=_ort_session_options(),
+    )
+    processor = WhisperProcessor.from_pretrained(ASR_ONNX_DIR)
+    return pipeline(
+        "automatic-speech-recognition",
+        model=model,
+        tokenizer=processor.tokenizer,
+        feature_extractor=processor.feature_extractor,
+        chunk_length_s=30,
+    )
+
+
 def get_asr_model():
+    """
+    int4 ONNX Runtime Whisper on CPU when ASR_ONNX_DIR has an export.
+    Otherwise a batched faster-whisper pipeline: int8 weights with fp16
+    compute on GPU, plain int8 on CPU. VAD-split chunks of one file are
+    decoded as a batch.
+    """
     global _whisper_model
     if _whisper_model is None:
-        _whisper_model = WhisperModel(ASR_MODEL_NAME, device="cpu", compute_type="int8")
+        if not torch.cuda.is_available() and os.path.isfile(
+            os.path.join(ASR_ONNX_DIR, "encoder_model.onnx")
+        ):
+            try:
+                _whisper_model = _load_onnx_asr()
+                return _whisper_model
+            except Exception as e:
+                print(f"ONNX Whisper unavailable, falling back to faster-whisper: {e!r}")
+
+        if torch.cuda.is_available():
+            device, compute_type = "cuda", "int8_float16"
+        else:
+            device, compute_type = "cpu", "int8"
+        model = WhisperModel(
+            _ensure_int8_model(),
+            device=device,
+            compute_type=compute_type,
+            cpu_threads=os.cpu_count() or 0,
+            num_workers=2,
+        )
+        _whisper_model = BatchedInferencePipeline(model=model)
     return _whisper_model
 
 def transcribe_audio_file(file_path: str, language_hint: str = "English") -> str:
     model = get_asr_model()
     target_lang_code = LANG_CODES.get(language_hint, "en")
-    
+
     # task="transcribe" ensures output is in the native script
-    segments, _ = model.transcribe(file_path, language=target_lang_code, task="transcribe")
+    if not isinstance(model, BatchedInferencePipeline):
+        audio = decode_audio(file_path, sampling_rate=ASR_SAMPLE_RATE)
+        result = model(
+            {"raw": audio, "sampling_rate": ASR_SAMPLE_RATE},
+            batch_size=ASR_BATCH_SIZE,
+            generate_kwargs={"language": target_lang_code, "task": "transcribe"},
+        )
+        return result["text"].strip()
+
+    segments, _ = model.transcribe(
+        file_path,
+        language=target_lang_code,
+        task="transcribe",
+        batch_size=ASR_BATCH_SIZE,
+        vad_filter=True,
+        beam_size=ASR_BEAM_SIZE,
+        best_of=1,
+        condition_on_previous_text=False,
+        without_timestamps=True,
+    )
     return " ".join([seg.text for seg in segments]).strip()
 
+# Local Piper voices (<name>.onnx + <name>.onnx.json) under PIPER_VOICE_DIR.
+# Languages without a voice file there fall back to gTTS.
+PIPER_VOICE_DIR = os.getenv("PIPER_VOICE_DIR", os.path.join("models", "piper"))
+PIPER_VOICES = {
+    "English": "en_US-lessac-medium",
+}
+
+_piper_voices = None
+_piper_lock = threading.Lock()
+
+
+def _load_piper_voice(model_path: str) -> PiperVoice:
+    with open(f"{model_path}.json", "r", encoding="utf-8") as f:
+        config = PiperConfig.from_dict(json.load(f))
+
+    session = onnxruntime.InferenceSession(
+        model_path, sess_options=_ort_session_options(), providers=["CPUExecutionProvider"]
+    )
+    return PiperVoice(session=session, config=config)
+
+
+def get_tts_voices() -> dict:
+    global _piper_voices
+    if _piper_voices is None:
+        with _piper_lock:
+            if _piper_voices is None:
+                voices = {}
+                for language_name, voice_name in PIPER_VOICES.items():
+                    model_path = os.path.join(PIPER_VOICE_DIR, f"{voice_name}.onnx")
+                    if not os.path.isfile(model_path):
+                        continue
+                    try:
+                        voices[language_name] = _load_piper_voice(model_path)
+                    except Exception as e:
+                        print(f"Piper voice {voice_name} not loaded: {e}")
+                _piper_voices = voices
+    return _piper_voices
+
+
+def _pcm_to_mp3(pcm: bytes, sample_rate: int) -> bytes:
+    """Mono 16-bit PCM -> MP3, so Piper parts concatenate like gTTS ones."""
+    buf = io.BytesIO()
+    # no ID3 tag / Xing header, so the output is bare frames like gTTS
+    with av.open(
+        buf, "w", format="mp3", options={"id3v2_version": "0", "write_xing": "0"}
+    ) as container:
+        stream = container.add_stream("libmp3lame", rate=sample_rate, layout="mono")
+        frame = av.AudioFrame.from_ndarray(
+            np.frombuffer(pcm, dtype=np.int16).reshape(1, -1), format="s16", layout="mono"
+        )
+        frame.sample_rate = sample_rate
+        for packet in stream.encode(frame):
+            container.mux(packet)
+        for packet in stream.encode(None):
+            container.mux(packet)
+    return buf.getvalue()
+
+
+def _piper_mp3(voice: PiperVoice, text: str) -> bytes:
+    pcm = b"".join(chunk.audio_int16_bytes for chunk in voice.synthesize(text))
+    return _pcm_to_mp3(pcm, voice.config.sample_rate)
+
+
 def text_to_speech(text: str, language_name: str, output_path: str):
+    audio = text_to_speech_bytes(text, language_name)
+    if audio is None:
+        return False
+    with open(output_path, "wb") as f:
+        f.write(audio)
+    return True
+
+
+def text_to_speech_bytes(text: str, language_name: str) -> Optional[bytes]:
+    """
+    MP3 bytes for `text`, or None on failure. Uses the local Piper voice
+    for the language when there is one, otherwise gTTS. Either way the
+    output is a plain MP3 frame stream, so parts for consecutive sentences
+    can be concatenated.
+    """
+    voice = get_tts_voices().get(language_name)
+    if voice is not None:
+        try:
+            return _piper_mp3(voice, text)
+        except Exception as e:
+            print(f"Piper TTS Error, falling back to gTTS: {e}")
+
     lang_code = LANG_CODES.get(language_name, "en")
     try:
-        tts = gTTS(text=text, lang=lang_code, slow=False)
-        tts.save(output_path)
-        return True
+        buf = io.BytesIO()
+        gTTS(text=text, lang=lang_code, slow=False).write_to_fp(buf)
+        return buf.getvalue()
     except Exception as e:
         print(f"TTS Error: {e}")
-        return False
\ No newline at end of file
+        return None
@@ -0,0 +1,29 @@
+from typing import Dict, List
+
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from . import models
+
+
+def _bulk_insert(db: Session, model, rows: List[Dict], commit: bool) -> List[int]:
+    if not rows:
+        return []
+
+    # One executemany INSERT; ids come back in the order of `rows`
+    ids = db.scalars(
+        insert(model).returning(model.id, sort_by_parameter_order=True),
+        rows,
+    ).all()
+
+    if commit:
+        db.commit()
+    return list(ids)
+
+
+def bulk_add_reports(db: Session, rows: List[Dict], commit: bool = True) -> List[int]:
+    """
+    Inserts many reports at once instead of one add/commit per row.
+    Returns the new report ids.
+    """
+    return _bulk_insert(db, models.Report, rows, commit)
@@ -2,6 +2,63 @@ import re
 import unicodedata
 
 
+# Patterns are compiled once at import; clean_medical_text runs on every
+# uploaded report.
+_NON_ASCII_RE = re.compile(r"[^\x20-\x7E\n\t]")
+# what _NON_ASCII_RE removes from text that is already ASCII
+_ASCII_CONTROL_DELETE = str.maketrans(
+    "", "", "".join(chr(c) for c in range(0x20) if chr(c) not in "\n\t") + "\x7f"
+)
+_WS_RE = re.compile(r"[ \t]+")
+_NL3_RE = re.compile(r"\n{3,}")
+_KV_RE = re.compile(r"([A-Za-z][A-Za-z0-9 %/()-]{3,})\n([0-9].{0,12})")
+
+_UNIT_MAP = {
+    "mg/dl": "mg/dL",
+    "mg / dl": "mg/dL",
+    "mmol/l": "mmol/L",
+    "mmol / l": "mmol/L",
+    "iu/l": "IU/L",
+    "iu / l": "IU/L",
+    "g/dl": "g/dL",
+    "g / dl": "g/dL"
+}
+
+# OCR'd letter O next to digits, in one pass:
+#   1O4 -> 1 0 4,  O5 -> 05,  5O -> 50
+# Equivalent to running the three alternatives as successive passes: none
+# of them creates or removes a digit that a later one would look at.
+_OCR_ZERO_RE = re.compile(r"(\d)O(\d)|O(?=\d)|(?<=\d)O")
+
+
+def _ocr_zero(m) -> str:
+    return f"{m.group(1)} 0 {m.group(2)}" if m.group(1) else "0"
+
+_ABBREV = {
+    "BP": "Blood Pressure",
+    "HR": "Heart Rate",
+    "RR": "Respiratory Rate",
+    "Temp": "Temperature",
+    "Dx": "Diagnosis",
+    "Rx": "Prescription",
+    "Hx": "History",
+    "Tx": "Treatment",
+}
+
+# Units (case-insensitive) and abbreviations (whole words) in one pass. The
+# two kinds can't overlap, and no replacement creates a match of the other
+# kind, so this equals running the unit pass and then the abbreviation pass.
+_TERM_RE = re.compile(
+    "(?i:" + "|".join(map(re.escape, _UNIT_MAP)) + ")"
+    + r"|\b(?:" + "|".join(_ABBREV) + r")\b"
+)
+
+
+def _expand_term(m) -> str:
+    term = m.group(0)
+    return _ABBREV.get(term) or _UNIT_MAP[term.lower()]
+
+
 def clean_medical_text(text: str) -> str:
     """
     Perform healthcare-specific preprocessing on extracted text
@@ -11,66 +68,37 @@ def clean_medical_text(text: str) -> str:
     if not text or not isinstance(text, str):
         return ""
 
-    text = unicodedata.normalize("NFKC", text)
-
-    text = text.replace("•", "- ").replace("", "- ")
-
-    text = re.sub(r"[^\x20-\x7E\n\t]", "", text)
-
-    text = re.sub(r"[ \t]+", " ", text)
-
-    text = re.sub(r"\n{3,}", "\n\n", text)
+    if text.isascii():
+        # NFKC and the bullet replacements are no-ops on ASCII; only the
+        # control characters are left for _NON_ASCII_RE to drop
+        text = text.translate(_ASCII_CONTROL_DELETE)
+    else:
+        text = unicodedata.normalize("NFKC", text)
 
+        text = text.replace("•", "- ").replace("", "- ")
 
-    text = re.sub(
-        r"([A-Za-z][A-Za-z0-9 %/()-]{3,})\n([0-9].{0,12})",
-        r"\1: \2",
-        text
-    )
+        text = _NON_ASCII_RE.sub("", text)
 
-    unit_map = {
-        "mg/dl": "mg/dL",
-        "mg / dl": "mg/dL",
-        "mmol/l": "mmol/L",
-        "mmol / l": "mmol/L",
-        "iu/l": "IU/L",
-        "iu / l": "IU/L",
-        "g/dl": "g/dL",
-        "g / dl": "g/dL"
-    }
+    text = _WS_RE.sub(" ", text)
 
-    for k, v in unit_map.items():
-        text = re.sub(k, v, text, flags=re.IGNORECASE)
+    text = _NL3_RE.sub("\n\n", text)
 
-    text = re.sub(r"(\d)O(\d)", r"\1 0 \2", text)   # 1O4 -> 1 0 4
-    text = re.sub(r"O(?=\d)", "0", text)            # O5 -> 05
-    text = re.sub(r"(?<=\d)O", "0", text)           # 50 -> 50
 
-    abbrev = {
-        r"\bBP\b": "Blood Pressure",
-        r"\bHR\b": "Heart Rate",
-        r"\bRR\b": "Respiratory Rate",
-        r"\bTemp\b": "Temperature",
-        r"\bDx\b": "Diagnosis",
-        r"\bRx\b": "Prescription",
-        r"\bHx\b": "History",
-        r"\bTx\b": "Treatment",
-    }
+    text = _KV_RE.sub(r"\1: \2", text)
 
-    for pattern, expanded in abbrev.items():
-        text = re.sub(pattern, expanded, text)
+    # the OCR fixes only touch a capital O, which units/abbreviations never
+    # produce or consume, so they can run first
+    if "O" in text:
+        text = _OCR_ZERO_RE.sub(_ocr_zero, text)
 
-    lines = text.split("\n")
-    cleaned_lines = []
-    seen = set()
+    text = _TERM_RE.sub(_expand_term, text)
 
-    for line in lines:
-        stripped = line.strip()
-        if stripped not in seen:
-            cleaned_lines.append(line)
-            seen.add(stripped)
+    # first line for each distinct stripped content, in original order
+    first_lines = {}
+    for line in text.split("\n"):
+        first_lines.setdefault(line.strip(), line)
 
-    text = "\n".join(cleaned_lines)
+    text = "\n".join(first_lines.values())
 
     text = text.strip()
 
@@ -1,18 +1,109 @@
 import os
 import json
-import csv
 import io
+import uuid
 import hashlib
-from typing import Optional
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional
+
+import aiofiles
+import pandas as pd
 
 import pdfplumber
 from PIL import Image
 import pytesseract
 from docx import Document  # for .docx
 
-def extract_text_from_file(file_path: str) -> str:
+try:
+    from tesserocr import PyTessBaseAPI
+except ImportError:  # fall back to the tesseract CLI through pytesseract
+    PyTessBaseAPI = None
+
+# Parsed text is cached on disk by (content hash, extension), so files that
+# are uploaded again skip OCR / PDF parsing. Entries are touched on every
+# hit and the least recently used ones are pruned past TEXT_CACHE_MAX_FILES.
+TEXT_CACHE_DIR = os.getenv("TEXT_CACHE_DIR", os.path.join(".cache", "parsed_text"))
+TEXT_CACHE_MAX_FILES = 10000
+_TEXT_CACHE_PRUNE_EVERY = 100
+_text_cache_writes = 0
+
+
+def extract_text_from_file(file_path: str, content_hash: Optional[bytes] = None) -> str:
+    """
+    Text of an uploaded file. content_hash is the raw SHA-256 of the file
+    when the caller already has it (save_upload_file returns it).
+    """
     ext = os.path.splitext(file_path)[1].lower()
 
+    try:
+        if content_hash is None:
+            content_hash = calculate_file_hash(file_path)
+    except OSError:
+        return ""
+
+    cache_path = os.path.join(TEXT_CACHE_DIR, f"{content_hash.hex()}{ext}.txt")
+    text = _read_text_cache(cache_path)
+    if text is None:
+        text = _extract_text(file_path, ext)
+        # empty usually means a failed extraction; don't pin it
+        if text:
+            _write_text_cache(cache_path, text)
+    return text
+
+
+def _read_text_cache(cache_path: str) -> Optional[str]:
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            text = f.read()
+        os.utime(cache_path)
+    except OSError:
+        return None
+    return text
+
+
+def _write_text_cache(cache_path: str, text: str):
+    global _text_cache_writes
+    tmp_path = f"{cache_path}.{uuid.uuid4().hex}.tmp"
+    try:
+        os.makedirs(TEXT_CACHE_DIR, exist_ok=True)
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        print(f"Text cache write failed: {e}")
+        return
+
+    _text_cache_writes += 1
+    if _text_cache_writes % _TEXT_CACHE_PRUNE_EVERY == 0:
+        _prune_text_cache()
+
+
+def _prune_text_cache():
+    try:
+        entries = [e for e in os.scandir(TEXT_CACHE_DIR) if e.name.endswith(".txt")]
+    except OSError:
+        return
+    excess = len(entries) - TEXT_CACHE_MAX_FILES
+    if excess <= 0:
+        return
+
+    def mtime(entry):
+        try:
+            return entry.stat().st_mtime
+        except OSError:
+            return 0.0
+
+    entries.sort(key=mtime)
+    for entry in entries[:excess]:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+
+
+def _extract_text(file_path: str, ext: str) -> str:
     try:
         if ext == ".txt":
             return _extract_text_from_txt(file_path)
@@ -35,18 +126,70 @@ def _extract_text_from_txt(file_path: str) -> str:
     with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
         return f.read()
 
+# pdfminer is pure Python and holds the GIL, so multi-page PDFs are split
+# into contiguous page ranges extracted in worker processes. The pool is
+# created on first use and shared across requests.
+PDF_PARALLEL_MIN_PAGES = 4
+PDF_MAX_WORKERS = min(8, os.cpu_count() or 1)
+_pdf_pool = None
+_pdf_pool_lock = threading.Lock()
+
+
+def _get_pdf_pool() -> ProcessPoolExecutor:
+    global _pdf_pool
+    if _pdf_pool is None:
+        with _pdf_pool_lock:
+            if _pdf_pool is None:
+                # spawn: don't fork a parent that holds torch/FAISS threads
+                _pdf_pool = ProcessPoolExecutor(
+                    max_workers=PDF_MAX_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+    return _pdf_pool
+
+
+def _extract_pdf_pages(file_path: str, start: int, stop: int) -> List[str]:
+    with pdfplumber.open(file_path, pages=range(start + 1, stop + 1)) as pdf:
+        return [page.extract_text() or "" for page in pdf.pages]
+
+
+def _join_pdf_pages(pages: List[str]) -> str:
+    return "".join(page_text + "\n" for page_text in pages).strip()
+
+
 def _extract_text_from_pdf(file_path: str) -> str:
-    text = ""
     with pdfplumber.open(file_path) as pdf:
-        for page in pdf.pages:
-            page_text = page.extract_text() or ""
-            text += page_text + "\n"
-    return text.strip()
+        n_pages = len(pdf.pages)
+        if n_pages < PDF_PARALLEL_MIN_PAGES or PDF_MAX_WORKERS < 2:
+            return _join_pdf_pages([page.extract_text() or "" for page in pdf.pages])
+
+    step = -(-n_pages // PDF_MAX_WORKERS)
+    starts = range(0, n_pages, step)
+    chunks = _get_pdf_pool().map(
+        _extract_pdf_pages,
+        [file_path] * len(starts),
+        starts,
+        [min(start + step, n_pages) for start in starts],
+    )
+    return _join_pdf_pages([page_text for chunk in chunks for page_text in chunk])
+
+# One in-process tesseract with the eng model kept loaded, instead of a
+# tesseract subprocess per image. PyTessBaseAPI is not thread-safe.
+_tess_api = None
+_tess_lock = threading.Lock()
+
 
 def _extract_text_from_image(file_path: str) -> str:
+    global _tess_api
     img = Image.open(file_path)
-    text = pytesseract.image_to_string(img)
-    return text.strip()
+    if PyTessBaseAPI is None:
+        return pytesseract.image_to_string(img).strip()
+
+    with _tess_lock:
+        if _tess_api is None:
+            _tess_api = PyTessBaseAPI(lang="eng")
+        _tess_api.SetImage(img)
+        return _tess_api.GetUTF8Text().strip()
 
 def _extract_text_from_docx(file_path: str) -> str:
     doc = Document(file_path)
@@ -79,27 +222,81 @@ def _extract_text_from_json(file_path: str) -> str:
 def _extract_text_from_csv(file_path: str) -> str:
     """
     Converts CSV lab data into readable medical text.
+    Parsed by pandas' C reader with every cell kept as the raw string;
+    the "column: value" lines are built column-wise.
     """
     try:
-        with open(file_path, "r", encoding="utf-8") as f:
-            reader = csv.DictReader(f)
-            rows = list(reader)
+        df = pd.read_csv(
+            file_path, dtype=str, keep_default_na=False, engine="c", encoding="utf-8"
+        )
     except Exception:
         return ""
 
-    if not rows:
+    if df.empty:
         return ""
 
-    blocks = []
-    for row in rows:
-        lines = [f"{k}: {v}" for k, v in row.items()]
-        blocks.append("\n".join(lines))
+    lines = [f"{col}: " + df[col].fillna("None") for col in df.columns]
+    blocks = lines[0].str.cat(lines[1:], sep="\n") if len(lines) > 1 else lines[0]
+    return "\n\n---\n\n".join(blocks.tolist())
 
-    return "\n\n---\n\n".join(blocks)
 
-def calculate_content_hash(file_bytes: bytes) -> str:
+def tail_join(parts: List[str], sep: str, max_chars: int) -> str:
+    """
+    Same result as sep.join(parts)[-max_chars:], but only the parts that
+    survive the cut are joined, so a long history isn't materialized just
+    to be sliced away.
     """
-    Generates a SHA-256 hash of file content.
+    kept = []
+    remaining = max_chars
+    for i, part in enumerate(reversed(parts)):
+        # walking backwards, the separator comes before every part but the last
+        for piece in ((sep, part) if i else (part,)):
+            if len(piece) >= remaining:
+                kept.append(piece[len(piece) - remaining:])
+                return "".join(reversed(kept))
+            kept.append(piece)
+            remaining -= len(piece)
+    return "".join(reversed(kept))
+
+
+# hashlib.sha256 is OpenSSL's, which uses SHA-NI / ARMv8 SHA instructions
+# when the CPU has them. Uploads never go through calculate_content_hash:
+# save_upload_file hashes the stream chunk by chunk as it is written.
+def calculate_content_hash(file_bytes: bytes) -> bytes:
+    """
+    Generates the raw 32-byte SHA-256 digest of file content.
     Used to prevent duplicate report uploads.
     """
-    return hashlib.sha256(file_bytes).hexdigest()
\ No newline at end of file
+    return hashlib.sha256(file_bytes).digest()
+
+
+def calculate_file_hash(file_path: str) -> bytes:
+    """
+    Same digest as calculate_content_hash, for a file already on disk.
+    Reads in native code (hashlib.file_digest on Python 3.11+) without
+    loading the file into memory.
+    """
+    with open(file_path, "rb") as f:
+        if hasattr(hashlib, "file_digest"):
+            return hashlib.file_digest(f, "sha256").digest()
+        hasher = hashlib.sha256()
+        while chunk := f.read(UPLOAD_CHUNK_SIZE):
+            hasher.update(chunk)
+        return hasher.digest()
+
+
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+
+async def save_upload_file(upload, dest_path: str, chunk_size: int = UPLOAD_CHUNK_SIZE) -> bytes:
+    """
+    Streams an UploadFile to dest_path chunk by chunk, hashing as it goes,
+    so memory stays O(chunk) regardless of file size.
+    Returns the same raw SHA-256 digest as calculate_content_hash.
+    """
+    hasher = hashlib.sha256()
+    async with aiofiles.open(dest_path, "wb") as f:
+        while chunk := await upload.read(chunk_size):
+            hasher.update(chunk)
+            await f.write(chunk)
+    return hasher.digest()
@@ -1,9 +1,21 @@
 import re
+import string
+from functools import lru_cache
 
-def normalize(text: str):
-    return set(
-        re.sub(r"[^a-zA-Z0-9 ]", "", text.lower()).split()
-    )
+_NON_TOKEN_RE = re.compile(r"[^a-zA-Z0-9 ]")
+# Same deletion as _NON_TOKEN_RE for lowercased ASCII text, without the regex engine
+_KEEP = set(string.ascii_lowercase + string.digits + " ")
+_DROP_NON_TOKEN = str.maketrans("", "", "".join(c for c in map(chr, range(128)) if c not in _KEEP))
+
+# The same retrieved context is scored against many answers in a batch eval
+@lru_cache(maxsize=256)
+def normalize(text: str) -> frozenset:
+    text = text.lower()
+    if text.isascii():
+        text = text.translate(_DROP_NON_TOKEN)
+    else:
+        text = _NON_TOKEN_RE.sub("", text)
+    return frozenset(text.split())
 
 def faithfulness_score(answer: str, retrieved_context: str) -> float:
     """
@@ -1,15 +1,23 @@
+def _as_set(relevant):
+    # membership is checked once per retrieved id; lists make that O(n)
+    return relevant if isinstance(relevant, (set, frozenset)) else set(relevant)
+
+
 def precision_at_k(retrieved, relevant, k=5):
+    relevant_set = _as_set(relevant)
     retrieved_k = retrieved[:k]
-    return sum(1 for r in retrieved_k if r in relevant) / k
+    return sum(1 for r in retrieved_k if r in relevant_set) / k
 
 
 def recall_at_k(retrieved, relevant, k=5):
+    relevant_set = _as_set(relevant)
     retrieved_k = retrieved[:k]
-    return sum(1 for r in retrieved_k if r in relevant) / len(relevant)
+    return sum(1 for r in retrieved_k if r in relevant_set) / len(relevant)
 
 
 def mean_reciprocal_rank(retrieved, relevant):
+    relevant_set = _as_set(relevant)
     for idx, r in enumerate(retrieved):
-        if r in relevant:
+        if r in relevant_set:
             return 1 / (idx + 1)
     return 0
@@ -1,3 +1,5 @@
+import asyncio
+
 from app.llm import generate_text
 from evaluations.summarization_metrics import compute_rouge
 
@@ -18,11 +20,11 @@ def evaluate_summary():
     test results: Inconclusive
     """
 
-    generated_summary = generate_text(
+    generated_summary = asyncio.run(generate_text(
         system_prompt="Generate a concise medical summary",
         user_prompt=report_text,
         max_tokens=150
-    )
+    ))
 
     reference_summary = (
         """The patient presents with Hypertension, a chronic condition characterized by elevated blood pressure.
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from app import llm_cache
+
+SYSTEM = "You are a careful medical assistant."
+
+
+def _prompt(record: str) -> str:
+    return f"Patient record snippets:\n{record}\n\nUser question:\nIs my blood pressure ok?"
+
+
+@pytest.fixture(autouse=True)
+def same_embedding(monkeypatch):
+    # Worst case for the semantic tier: both records embed identically
+    vec = np.ones((1, 8), dtype=np.float32) / np.sqrt(8)
+    monkeypatch.setattr(llm_cache, "_embed", lambda user_prompt: vec.copy())
+    llm_cache.clear()
+    yield
+    llm_cache.clear()
+
+
+def test_near_identical_records_of_two_patients_do_not_share_an_entry():
+    llm_cache.store(SYSTEM, _prompt("BP 120/80"), 600, "Your BP is normal.", scope="P001")
+
+    cached, _ = llm_cache.lookup(SYSTEM, _prompt("BP 180/110"), 600, scope="P002")
+
+    assert cached is None
+
+
+def test_semantic_hit_within_the_same_patient():
+    llm_cache.store(SYSTEM, _prompt("BP 120/80"), 600, "Your BP is normal.", scope="P001")
+
+    cached, _ = llm_cache.lookup(SYSTEM, _prompt("BP 120/80 "), 600, scope="P001")
+
+    assert cached == "Your BP is normal."
+
+
+def test_unscoped_prompts_skip_the_semantic_tier():
+    llm_cache.store(SYSTEM, _prompt("BP 120/80"), 600, "Your BP is normal.")
+
+    assert llm_cache.lookup(SYSTEM, _prompt("BP 180/110"), 600) == (None, None)
+    # the exact tier still answers the identical prompt
+    assert llm_cache.lookup(SYSTEM, _prompt("BP 120/80"), 600)[0] == "Your BP is normal."
@@ -0,0 +1,98 @@
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app import models
+from app.database import Base
+from app.deps import get_db, NEXT_CURSOR_HEADER
+from app.routers import reports
+from app.routers.auth import CurrentUser, get_current_user
+
+
+@pytest.fixture
+def db_session():
+    engine = create_engine(
+        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+    )
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+
+
+@pytest.fixture
+def client(db_session):
+    app = FastAPI()
+    app.include_router(reports.router)
+    app.dependency_overrides[get_db] = lambda: db_session
+    app.dependency_overrides[get_current_user] = lambda: CurrentUser(
+        id=1, username="doc", role="doctor"
+    )
+    return TestClient(app)
+
+
+def _add_reports(db, created_ats):
+    for i, created_at in enumerate(created_ats):
+        db.add(models.Report(
+            patient_id="P001",
+            uploaded_by=1,
+            uploader_role="doctor",
+            report_type="lab",
+            file_path=f"lab://P001/{i}",
+            created_at=created_at,
+        ))
+    db.commit()
+
+
+def _walk(client, limit):
+    pages, cursor = [], None
+    while True:
+        params = {"limit": limit}
+        if cursor:
+            params["cursor"] = cursor
+        resp = client.get("/reports/by-patient/P001", params=params)
+        assert resp.status_code == 200
+        pages.append([r["id"] for r in resp.json()])
+        cursor = resp.headers.get(NEXT_CURSOR_HEADER)
+        if not cursor:
+            return pages
+
+
+def test_two_pages_follow_the_next_cursor_header(client, db_session):
+    start = datetime(2024, 1, 1)
+    _add_reports(db_session, [start + timedelta(days=d) for d in range(4)])
+
+    pages = _walk(client, limit=2)
+
+    # newest first, nothing repeated or skipped
+    assert pages[:2] == [[4, 3], [2, 1]]
+    assert [i for page in pages for i in page] == [4, 3, 2, 1]
+
+
+def test_legacy_rows_without_created_at_come_last(client, db_session):
+    _add_reports(db_session, [datetime(2024, 1, 1), datetime(2024, 1, 2)])
+    # rows written before created_at was always set
+    db_session.execute(
+        models.Report.__table__.insert(),
+        [
+            {"patient_id": "P001", "uploaded_by": 1, "uploader_role": "doctor",
+             "report_type": "lab", "file_path": f"lab://P001/legacy{i}", "created_at": None}
+            for i in range(3)
+        ],
+    )
+    db_session.commit()
+
+    pages = _walk(client, limit=2)
+
+    assert [i for page in pages for i in page] == [2, 1, 5, 4, 3]
+
+
+def test_malformed_cursor_is_rejected(client):
+    resp = client.get("/reports/by-patient/P001", params={"cursor": "not-a-cursor"})
+
+    assert resp.status_code == 400